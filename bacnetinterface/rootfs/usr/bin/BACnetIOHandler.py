@@ -2,14 +2,17 @@
 
 import asyncio
 import json
+import os
+import time
 from ast import List
+from collections import deque
+from datetime import datetime
 from logging import config
 from math import e, isinf, isnan
 from re import A
 from typing import Any, Dict, TypeVar
 
 import backoff
-import requests
 import websockets
 from bacpypes3.apdu import (AbortPDU, ConfirmedCOVNotificationRequest,
                             ErrorPDU, ErrorRejectAbortNack,
@@ -31,46 +34,23 @@ from bacpypes3.local.binary import BinaryInputObject, BinaryValueObject
 from bacpypes3.object import CharacterStringValueObject, get_vendor_info
 from bacpypes3.pdu import Address
 from bacpypes3.primitivedata import ObjectIdentifier, ObjectType, OctetString
-from bacpypes3.service.cov import SubscriptionContextManager
 from const import (LOGGER, device_properties_to_read,
                    object_properties_to_read_once,
                    object_properties_to_read_periodically,
                    subscribable_objects)
+from haClient import HomeAssistantClient
+from subscriptionManager import (ConfirmedCOVNotificationMultipleRequest,
+                                 SubscriptionManager)
 
 KeyType = TypeVar("KeyType")
 _debug = 0
 
 
-def custom_init(
-    self,
-    app: "Application",  # noqa: F821
-    address: Address,
-    monitored_object_identifier: ObjectIdentifier,
-    subscriber_process_identifier: int,
-    issue_confirmed_notifications: bool,
-    lifetime: int,
-):
-    original_init(
-        self,
-        app,
-        address,
-        monitored_object_identifier,
-        subscriber_process_identifier,
-        issue_confirmed_notifications,
-        lifetime,
-    )
-
-    # result of refresh task to check if exception occurred
-    self.refresh_subscription_task = None
-
-
-original_init = SubscriptionContextManager.__init__
-
-SubscriptionContextManager.__init__ = custom_init
-
-
 class BACnetIOHandler(NormalApplication, ForeignApplication):
     bacnet_device_dict: dict = {}
+    bacnet_property_metadata: dict = {}
+    cov_health: dict = {}
+    cov_quiet: set = set()
     subscription_tasks: list = []
     update_event: asyncio.Event = asyncio.Event()
     startup_complete: asyncio.Event = asyncio.Event()
@@ -83,8 +63,37 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
     default_subscription_lifetime = 60
     subscription_list = []
     i_am_queue: asyncio.Queue = asyncio.Queue()
+    i_am_pending: set = set()
+    explored_devices: set = set()
+    exploring_devices: set = set()
+    failed_devices: set = set()
+    discovery_workers: int = 4
+    discovery_mode: str = "global"
+    who_is_range_size: int = 1000
+    who_is_rate: int = 5
+    who_is_max_instance: int = 4194302
+    who_is_ranges: dict = {}
+    rediscovery_interval: int = 3600
+    cov_filters: list = []
+    rediscovery_window: int = 30
+    vanish_rounds: int = 2
+    device_last_seen: dict = {}
+    device_missed_rounds: dict = {}
+    discovery_events: deque = deque(maxlen=500)
     poll_tasks: list[asyncio.Task] = []
+    poll_task_objects: dict = {}
+    fallback_poll_tasks: dict = {}
+    fallback_poll_rate: int = 60
     addon_device_config: list = []
+    snapshot_path: str = "/data/bacnet_snapshot.json"
+    snapshot_interval: int = 600
+    snapshot_revisions: dict = {}
+    snapshot_devices: set = set()
+    object_list_progress: dict = {}
+    object_list_window: dict = {}
+    object_list_chunk_size: int = 16
+    object_list_max_window: int = 8
+    object_list_rounds: int = 3
 
     def __init__(
         self,
@@ -94,23 +103,203 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
         ttl=255,
         update_event=asyncio.Event(),
         addon_device_config=[],
+        warm_start=True,
+        discovery_workers=4,
+        discovery_mode="global",
+        who_is_range_size=1000,
+        who_is_rate=5,
+        who_is_max_instance=4194302,
+        rediscovery_interval=3600,
+        cov_filters=[],
     ) -> None:
         if foreign_ip:
             ForeignApplication.__init__(self, device, local_ip)
             self.register(addr=Address(foreign_ip), ttl=int(ttl))
         else:
             NormalApplication.__init__(self, device, local_ip)
-        super().i_am()
-        super().who_is()
         self.update_event = update_event
         self.vendor_info = get_vendor_info(0)
-        asyncio.get_event_loop().create_task(self.IAm_handler())
+        self.subscription_manager = SubscriptionManager(
+            app=self, subscription_list=self.subscription_tasks
+        )
+        self.subscription_manager.start()
+        self.warm_start = warm_start
+        if self.warm_start:
+            self.load_snapshot()
+            asyncio.get_event_loop().create_task(self.snapshot_task())
+        self.discovery_mode = discovery_mode
+        self.who_is_range_size = max(1, int(who_is_range_size))
+        self.who_is_rate = max(1, int(who_is_rate))
+        self.who_is_max_instance = int(who_is_max_instance)
+        self.rediscovery_interval = int(rediscovery_interval)
+        self.cov_filters = cov_filters if cov_filters else list()
+        super().i_am()
+        asyncio.get_event_loop().create_task(self.rediscovery_task())
+        self.discovery_workers = max(1, int(discovery_workers))
+        for _ in range(self.discovery_workers):
+            asyncio.get_event_loop().create_task(self.IAm_handler())
         self.addon_device_config = (
             addon_device_config if addon_device_config else list()
         )
         self.startup_complete.set()
         LOGGER.debug("Application initialised")
 
+    def load_snapshot(self) -> None:
+        """Restore devices and objects saved by a previous run."""
+        try:
+            with open(self.snapshot_path, "r") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except FileNotFoundError:
+            LOGGER.info("No snapshot found, discovering all devices")
+            return
+        except Exception as err:
+            LOGGER.warning(f"Failed to load snapshot {self.snapshot_path}: {err}")
+            return
+
+        for device_key, objects in snapshot.items():
+            device_properties = objects.get(device_key)
+
+            if not device_properties:
+                continue
+
+            # bring back the types the rest of the handler relies on
+            try:
+                device_properties["objectList"] = [
+                    ObjectIdentifier((ObjectType(object_type), instance))
+                    for object_type, instance in device_properties.get(
+                        "objectList", []
+                    )
+                ]
+                device_properties["protocolServicesSupported"] = ServicesSupported(
+                    device_properties.get("protocolServicesSupported", [])
+                )
+            except Exception as err:
+                LOGGER.warning(f"Ignoring snapshot of {device_key}: {err}")
+                continue
+
+            if device_properties.get("databaseRevision") is not None:
+                self.snapshot_revisions[device_key] = device_properties[
+                    "databaseRevision"
+                ]
+
+            self.bacnet_device_dict[device_key] = objects
+            self.snapshot_devices.add(device_key)
+
+        LOGGER.info(
+            f"Restored {len(self.bacnet_device_dict)} devices from snapshot, {len(self.snapshot_revisions)} with databaseRevision"
+        )
+        self.update_event.set()
+
+    async def save_snapshot(self) -> None:
+        """Save devices and objects so the next start doesn't have to explore everything again.
+
+        Only copying the device dict happens on the event loop, encoding and writing run in a thread.
+        """
+        devices = {
+            device_key: {
+                object_key: {
+                    property_key: list(value) if isinstance(value, list) else value
+                    for property_key, value in properties.items()
+                }
+                for object_key, properties in objects.items()
+            }
+            for device_key, objects in self.bacnet_device_dict.items()
+        }
+
+        try:
+            await asyncio.to_thread(self.write_snapshot, devices)
+        except Exception as err:
+            LOGGER.warning(f"Failed to save snapshot {self.snapshot_path}: {err}")
+        else:
+            LOGGER.debug(f"Saved snapshot of {len(devices)} devices")
+
+    def write_snapshot(self, devices: dict) -> None:
+        """Write to a temporary file and swap it in, so a crash halfway keeps the previous snapshot."""
+        data = json.dumps(devices, default=str)
+
+        temp_path = f"{self.snapshot_path}.tmp"
+
+        with open(temp_path, "w") as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+
+        os.replace(temp_path, self.snapshot_path)
+
+    async def snapshot_task(self) -> None:
+        """Save a snapshot every so often."""
+        try:
+            while True:
+                await asyncio.sleep(self.snapshot_interval)
+                await self.save_snapshot()
+        except asyncio.CancelledError as err:
+            LOGGER.debug(f"Snapshot task cancelled: {err}")
+
+    def drop_snapshot(self, device_key: str) -> None:
+        """Forget the restored objects of a device about to be explored again, so deleted objects don't linger."""
+        if device_key in self.snapshot_devices:
+            self.snapshot_devices.discard(device_key)
+            self.bacnet_device_dict.pop(device_key, None)
+            self.bacnet_property_metadata.pop(device_key, None)
+
+    async def snapshot_is_valid(self, apdu) -> bool:
+        """Check whether the databaseRevision of a device is still the same as in the snapshot.
+
+        If it is, only the dynamic values get read instead of exploring the whole device.
+        """
+        device_identifier = ObjectIdentifier(apdu.iAmDeviceIdentifier)
+        device_key = f"device:{device_identifier[1]}"
+
+        revision = self.snapshot_revisions.pop(device_key, None)
+
+        if revision is None:
+            self.drop_snapshot(device_key)
+            return False
+
+        try:
+            current_revision = await self.read_property(
+                address=apdu.pduSource,
+                objid=device_identifier,
+                prop=PropertyIdentifier("databaseRevision"),
+            )
+        except ErrorRejectAbortNack as err:
+            LOGGER.warning(
+                f"Failed to read databaseRevision of {device_identifier}: {err}"
+            )
+            self.drop_snapshot(device_key)
+            return False
+
+        if current_revision != revision:
+            LOGGER.info(
+                f"databaseRevision of {device_identifier} changed from {revision} to {current_revision}, exploring again"
+            )
+            self.drop_snapshot(device_key)
+            return False
+
+        self.snapshot_devices.discard(device_key)
+
+        LOGGER.info(
+            f"databaseRevision of {device_identifier} unchanged, refreshing values only"
+        )
+
+        self.dict_updater(
+            device_identifier=device_identifier,
+            object_identifier=device_identifier,
+            property_identifier=PropertyIdentifier("databaseRevision"),
+            property_value=current_revision,
+        )
+
+        services_supported = self.bacnet_device_dict[device_key][device_key].get(
+            "protocolServicesSupported", ServicesSupported()
+        )
+
+        if services_supported["read-property-multiple"] == 1:
+            await self.read_multiple_objects_periodically(device_identifier=device_key)
+        else:
+            await self.read_objects_periodically(device_identifier=device_key)
+
+        return True
+
     def get_config_from_addon_config(self, device_identifier: ObjectIdentifier) -> dict:
         specific_config = next(
             (
@@ -321,7 +510,8 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
             )
 
             while True:
-                for object_identifier in object_list:
+                # copy, the list gets reconciled when the object list of the device changes
+                for object_identifier in list(object_list):
                     object_class = self.vendor_info.get_object_class(
                         object_identifier[0]
                     )
@@ -332,6 +522,12 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                         )
                         continue
 
+                    if self.is_fresh_from_cov(
+                        device_identifier, object_identifier, poll_rate
+                    ) or self.cov_suppresses_poll(device_identifier, object_identifier):
+                        # CoV delivered this value more recently than we'd poll it
+                        continue
+
                     if services_supported["read-property-multiple"] == 1:
                         try:
                             response = await self.read_property_multiple(
@@ -359,6 +555,7 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                                         object_identifier=object_identifier,
                                         property_identifier=property_identifier,
                                         property_value=property_value,
+                                        source="poll",
                                     )
                     else:
                         for property_id in object_properties_to_read_periodically:
@@ -385,6 +582,7 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                                         object_identifier=object_identifier,
                                         property_identifier=property_id,
                                         property_value=response,
+                                        source="poll",
                                     )
 
                 await asyncio.sleep(poll_rate)
@@ -458,11 +656,120 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
 
             self.poll_tasks.append(task)
 
+            self.poll_task_objects[task] = (poll_rate, objects_to_poll)
+
+            task.add_done_callback(
+                lambda task: self.poll_task_objects.pop(task, None)
+            )
+
         except Exception as err:
             LOGGER.error(
                 f"Failed to create polling task {device_identifier}, {object_identifier}"
             )
 
+    def start_fallback_poll(
+        self, device_identifier: ObjectIdentifier, object_identifier: ObjectIdentifier
+    ) -> None:
+        """Poll an object whose CoV subscription failed, unless a poll task covers it often enough already."""
+        device_key = self.identifier_to_string(device_identifier)
+
+        poll_rate = self.get_config_from_addon_config(device_identifier).get(
+            "CoV_fallback_poll_rate", self.fallback_poll_rate
+        )
+
+        fallback_task = self.fallback_poll_tasks.get(device_key)
+
+        for task, (task_poll_rate, objects) in self.poll_task_objects.items():
+            if (
+                task is not fallback_task
+                and task.get_name() == device_key
+                and object_identifier in objects
+                and task_poll_rate <= poll_rate
+            ):
+                return
+
+        if fallback_task:
+            objects = self.poll_task_objects[fallback_task][1]
+            if object_identifier not in objects:
+                objects.append(object_identifier)
+            return
+
+        objects = [object_identifier]
+
+        task = asyncio.create_task(
+            self.poll_task(device_identifier, objects, poll_rate),
+            name=device_key,
+        )
+
+        self.poll_tasks.append(task)
+        self.poll_task_objects[task] = (poll_rate, objects)
+        self.fallback_poll_tasks[device_key] = task
+
+        task.add_done_callback(lambda task: self.poll_task_objects.pop(task, None))
+
+        def forget_fallback_task(task: asyncio.Task) -> None:
+            if self.fallback_poll_tasks.get(device_key) is task:
+                self.fallback_poll_tasks.pop(device_key)
+
+        task.add_done_callback(forget_fallback_task)
+
+    def stop_fallback_poll(
+        self, device_identifier: ObjectIdentifier, object_identifier: ObjectIdentifier
+    ) -> None:
+        """Stop polling an object once its CoV subscription works again."""
+        device_key = self.identifier_to_string(device_identifier)
+
+        task = self.fallback_poll_tasks.get(device_key)
+
+        if task is None or task not in self.poll_task_objects:
+            return
+
+        objects = self.poll_task_objects[task][1]
+
+        if object_identifier in objects:
+            objects.remove(object_identifier)
+
+        if not objects:
+            task.cancel()
+            self.fallback_poll_tasks.pop(device_key, None)
+            if task in self.poll_tasks:
+                self.poll_tasks.remove(task)
+
+    def delivery_modes(self, device_key: str | None = None) -> dict:
+        """How every object gets its values: "cov", "cov-pending", "poll-fallback", "poll" or "none"."""
+        polled = {
+            (task.get_name(), self.identifier_to_string(object_identifier))
+            for task, (poll_rate, objects) in self.poll_task_objects.items()
+            for object_identifier in objects
+        }
+
+        modes: dict = {}
+
+        for device, objects in self.bacnet_device_dict.items():
+            if device_key and device != device_key:
+                continue
+
+            modes[device] = {}
+
+            for object_key in objects:
+                if object_key == device:
+                    continue
+
+                subscription = self.subscription_manager.subscriptions.get(
+                    (device, object_key)
+                )
+
+                if subscription:
+                    modes[device][object_key] = self.subscription_manager.delivery_mode(
+                        subscription
+                    )
+                elif (device, object_key) in polled:
+                    modes[device][object_key] = "poll"
+                else:
+                    modes[device][object_key] = "none"
+
+        return modes
+
     def deep_update(
         self, mapping: Dict[KeyType, Any], *updating_mappings: Dict[KeyType, Any]
     ) -> Dict[KeyType, Any]:
@@ -481,20 +788,21 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
         return mapping
 
     def dev_to_addr(self, dev: ObjectIdentifier) -> Address | None:
+        """Current address of a device, every request looks it up so a move applies right away."""
+        device_info = self.device_info_cache.instance_cache.get(dev[1])
 
-        for address, device_info in self.device_info_cache.address_cache.items():
-            if device_info.device_instance == dev[1]:
-                return address
+        if device_info is None:
+            return None
 
-        return None
+        return device_info.device_address
 
     def addr_to_dev(self, addr: Address) -> ObjectIdentifier | None:
-        for address in self.device_info_cache.address_cache:
-            if addr == address:
-                return ObjectIdentifier(
-                    f"device:{self.device_info_cache.address_cache[address].device_instance}"
-                )
-        return None
+        device_info = self.device_info_cache.address_cache.get(addr)
+
+        if device_info is None:
+            return None
+
+        return ObjectIdentifier(f"device:{device_info.device_instance}")
 
     def assign_id(self, obj: ObjectIdentifier, dev: ObjectIdentifier) -> int:
         """Assign an ID to the given object and return it."""
@@ -538,20 +846,44 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
 
         device_id = apdu.iAmDeviceIdentifier[1]
 
+        self.device_seen(device_id)
+
+        moved = False
+
         if device_id in self.device_info_cache.instance_cache:
             LOGGER.debug(f"Device {apdu.iAmDeviceIdentifier} already in cache!")
+            old_address = self.dev_to_addr(apdu.iAmDeviceIdentifier)
             await self.device_info_cache.set_device_info(apdu)
             in_cache = True
+
+            if old_address and old_address != apdu.pduSource:
+                self.device_moved(apdu.iAmDeviceIdentifier, old_address, apdu.pduSource)
+                moved = True
         else:
             await self.device_info_cache.set_device_info(apdu)
             in_cache = False
 
         await super().do_IAmRequest(apdu)
 
-        if not in_cache:
+        if device_id in self.i_am_pending:
+            LOGGER.debug(f"Device {apdu.iAmDeviceIdentifier} is already being explored")
+            return
+
+        if not in_cache or device_id not in self.explored_devices:
+            if device_id not in self.failed_devices:
+                self.discovery_event(
+                    "new", apdu.iAmDeviceIdentifier, address=str(apdu.pduSource)
+                )
+            self.i_am_pending.add(device_id)
             await self.i_am_queue.put(apdu)
             return
 
+        if not moved and not await self.revision_changed(apdu):
+            LOGGER.debug(
+                f"{apdu.iAmDeviceIdentifier} unchanged, skipping object list and CoV check"
+            )
+            return
+
         config = self.get_config_from_addon_config(apdu.iAmDeviceIdentifier)
 
         if config.get("reread_on_iam", True):
@@ -562,6 +894,51 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
             # Check if CoV tasks are still active, otherwise resub.
             await self.handle_cov_check(apdu.iAmDeviceIdentifier)
 
+    async def revision_changed(self, apdu) -> bool:
+        """Check whether the databaseRevision of a known device changed since it was read last.
+
+        Devices without a databaseRevision, or failing to report it, count as changed.
+        """
+        device_identifier = ObjectIdentifier(apdu.iAmDeviceIdentifier)
+        device_key = f"device:{device_identifier[1]}"
+
+        revision = (
+            self.bacnet_device_dict.get(device_key, {})
+            .get(device_key, {})
+            .get("databaseRevision")
+        )
+
+        if revision is None:
+            return True
+
+        try:
+            current_revision = await self.read_property(
+                address=apdu.pduSource,
+                objid=device_identifier,
+                prop=PropertyIdentifier("databaseRevision"),
+            )
+        except (ErrorRejectAbortNack, Exception) as err:
+            LOGGER.warning(
+                f"Failed to read databaseRevision of {device_identifier}: {err}"
+            )
+            return True
+
+        if current_revision == revision:
+            return False
+
+        LOGGER.info(
+            f"databaseRevision of {device_identifier} changed from {revision} to {current_revision}"
+        )
+
+        self.dict_updater(
+            device_identifier=device_identifier,
+            object_identifier=device_identifier,
+            property_identifier=PropertyIdentifier("databaseRevision"),
+            property_value=current_revision,
+        )
+
+        return True
+
     async def handle_object_list_check(self, apdu) -> None:
 
         device_id = apdu.iAmDeviceIdentifier[1]
@@ -582,12 +959,126 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
         if apdu.iAmDeviceIdentifier in new_object_list:
             new_object_list.remove(apdu.iAmDeviceIdentifier)
 
-        if list(old_object_list) != list(new_object_list):
-            LOGGER.debug(
-                f"Object lists aren't equal!... {old_object_list} -> {new_object_list}"
+        old_objects = set(old_object_list or [])
+        new_objects = set(new_object_list)
+
+        added_objects = [
+            object_identifier
+            for object_identifier in new_object_list
+            if object_identifier not in old_objects
+        ]
+        removed_objects = [
+            object_identifier
+            for object_identifier in old_objects
+            if object_identifier not in new_objects
+            and object_identifier != apdu.iAmDeviceIdentifier
+        ]
+
+        if not added_objects and not removed_objects:
+            return
+
+        LOGGER.info(
+            f"Object list of {apdu.iAmDeviceIdentifier} changed: {len(added_objects)} added, {len(removed_objects)} removed"
+        )
+
+        for object_identifier in removed_objects:
+            self.remove_object(apdu.iAmDeviceIdentifier, object_identifier)
+
+        if not added_objects:
+            return
+
+        services_supported = self.bacnet_device_dict[f"device:{device_id}"][
+            f"device:{device_id}"
+        ].get("protocolServicesSupported", ServicesSupported())
+
+        if services_supported["read-property-multiple"] == 1:
+            await self.read_multiple_objects(
+                device_identifier=apdu.iAmDeviceIdentifier, object_list=added_objects
             )
+        else:
+            await self.read_objects(
+                device_identifier=apdu.iAmDeviceIdentifier, object_list=added_objects
+            )
+
+        await self.add_object_tasks(apdu.iAmDeviceIdentifier, added_objects)
+
+    def remove_object(
+        self, device_identifier: ObjectIdentifier, object_identifier: ObjectIdentifier
+    ) -> None:
+        """Forget an object that disappeared from the object list of a device."""
+        device_key = self.identifier_to_string(device_identifier)
+        object_key = self.identifier_to_string(object_identifier)
 
-            await self.read_multiple_objects(apdu.iAmDeviceIdentifier)
+        LOGGER.debug(f"Removing {object_key} of {device_key}")
+
+        self.bacnet_device_dict.get(device_key, {}).pop(object_key, None)
+        self.bacnet_property_metadata.get(device_key, {}).pop(object_key, None)
+
+        for task in self.subscription_tasks:
+            if task.get_name().startswith(f"{device_key},{object_key},"):
+                task.cancel()
+
+        for task, (poll_rate, objects) in self.poll_task_objects.items():
+            if task.get_name() == device_key and object_identifier in objects:
+                objects.remove(object_identifier)
+
+        self.update_event.set()
+
+    async def add_object_tasks(
+        self,
+        device_identifier: ObjectIdentifier,
+        object_list: list[ObjectIdentifier],
+    ) -> None:
+        """Poll and subscribe to objects that got added to a device according to its configuration."""
+        device_key = self.identifier_to_string(device_identifier)
+
+        subscribable = [
+            object_identifier
+            for object_identifier in object_list
+            if object_identifier[0] in subscribable_objects
+        ]
+
+        config = (
+            self.get_config_from_addon_config(device_identifier)
+            if self.addon_device_config
+            else {}
+        )
+
+        if not config:
+            # no configuration for this device, subscribe like subscribe_object_list does
+            for object_identifier in subscribable:
+                await self.create_subscription_task(
+                    device_identifier=device_identifier,
+                    object_identifier=object_identifier,
+                    confirmed_notifications=True,
+                    lifetime=self.default_subscription_lifetime,
+                )
+            return
+
+        if "all" in config.get("slow_poll_list", []):
+            poll_rate = config.get("slow_poll_rate", 600)
+
+            for task, (task_poll_rate, objects) in self.poll_task_objects.items():
+                if task.get_name() == device_key and task_poll_rate == poll_rate:
+                    objects.extend(object_list)
+                    break
+            else:
+                await self.create_poll_task(
+                    device_identifier=device_identifier,
+                    object_list=object_list,
+                    poll_rate=poll_rate,
+                )
+
+        if "all" in config.get("CoV_list", []):
+            for object_identifier in subscribable:
+                await self.create_subscription_task(
+                    device_identifier=device_identifier,
+                    object_identifier=object_identifier,
+                    confirmed_notifications=True,
+                    lifetime=config.get(
+                        "CoV_lifetime", self.default_subscription_lifetime
+                    ),
+                )
 
     def identifier_to_string(self, object_identifier) -> str:
         return f"{object_identifier[0].attr}:{object_identifier[1]}"
@@ -670,42 +1161,231 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                 )
                 await asyncio.sleep(0)
 
+    async def explore_device(self, apdu) -> bool:
+        """Read the device properties and all objects of a device."""
+        device_id = apdu.iAmDeviceIdentifier[1]
+
+        # if failed stop handling response
+        if not await self.read_multiple_device_props(apdu=apdu):
+            LOGGER.warning(f"Failed to get: {device_id}, {device_id}")
+            if self.bacnet_device_dict.get(f"device:{device_id}"):
+                self.bacnet_device_dict.pop(f"device:{device_id}")
+            return False
+
+        if not self.bacnet_device_dict.get(f"device:{device_id}"):
+            LOGGER.warning(f"Failed to get: {device_id}")
+            return False
+
+        if not self.bacnet_device_dict[f"device:{device_id}"].get(
+            f"device:{device_id}"
+        ):
+            LOGGER.warning(f"Failed to get: {device_id}, {device_id}")
+            return False
+
+        services_supported = self.bacnet_device_dict[f"device:{device_id}"][
+            f"device:{device_id}"
+        ].get("protocolServicesSupported", ServicesSupported())
+
+        if services_supported["read-property-multiple"] == 1:
+            await self.read_multiple_objects(device_identifier=apdu.iAmDeviceIdentifier)
+        else:
+            await self.read_objects(device_identifier=apdu.iAmDeviceIdentifier)
+
+        return True
+
+    async def who_is_sweep(self) -> None:
+        """Send Who Is requests range by range over the device instances not covered recently."""
+        swept = 0
+
+        for low_limit in range(0, self.who_is_max_instance + 1, self.who_is_range_size):
+            high_limit = min(
+                low_limit + self.who_is_range_size - 1, self.who_is_max_instance
+            )
+
+            last_sweep = self.who_is_ranges.get((low_limit, high_limit))
+
+            if last_sweep is not None and (
+                not self.rediscovery_interval
+                or time.monotonic() - last_sweep < self.rediscovery_interval
+            ):
+                continue
+
+            self.who_is(low_limit, high_limit)
+
+            self.who_is_ranges[(low_limit, high_limit)] = time.monotonic()
+
+            swept += 1
+
+            await asyncio.sleep(1 / self.who_is_rate)
+
+        LOGGER.info(
+            f"Who Is sweep of {swept} ranges done, {len(self.device_info_cache.instance_cache)} devices known"
+        )
+
+    async def rediscovery_task(self) -> None:
+        """Look for devices every rediscovery interval and tear down the ones that stopped answering."""
+        try:
+            while True:
+                round_start = time.monotonic()
+
+                if self.discovery_mode == "ranged":
+                    await self.who_is_sweep()
+                else:
+                    self.who_is()
+
+                await asyncio.sleep(self.rediscovery_window)
+
+                await self.check_vanished_devices(round_start)
+
+                if not self.rediscovery_interval:
+                    return
+
+                await asyncio.sleep(self.rediscovery_interval)
+
+        except asyncio.CancelledError as err:
+            LOGGER.debug(f"Rediscovery task cancelled: {err}")
+
+    def device_seen(self, device_id: int) -> None:
+        """Note a sign of life of a device: an I Am, a value read from it or a notification it sent."""
+        self.device_last_seen[device_id] = time.monotonic()
+        self.device_missed_rounds.pop(device_id, None)
+
+    async def check_vanished_devices(self, round_start: float) -> None:
+        """Count rounds devices didn't answer in, by I Am, read or notification, and remove them after too many."""
+        device_ids = {
+            ObjectIdentifier(device_key)[1] for device_key in self.bacnet_device_dict
+        } | self.explored_devices
+
+        for device_id in device_ids:
+            if self.device_last_seen.get(device_id, 0) >= round_start:
+                continue
+
+            if device_id in self.i_am_pending:
+                continue
+
+            missed = self.device_missed_rounds.get(device_id, 0) + 1
+
+            self.device_missed_rounds[device_id] = missed
+
+            if missed < self.vanish_rounds:
+                continue
+
+            self.device_missed_rounds.pop(device_id, None)
+
+            device_identifier = ObjectIdentifier(f"device:{device_id}")
+
+            self.discovery_event("vanished", device_identifier, missed_rounds=missed)
+
+            await self.remove_device(device_identifier)
+
+    async def remove_device(self, device_identifier: ObjectIdentifier) -> None:
+        """Stop polling and subscribing to a device and forget its objects."""
+        device_key = self.identifier_to_string(device_identifier)
+
+        for task in self.subscription_tasks:
+            if task.get_name().startswith(f"{device_key},"):
+                task.cancel()
+
+        for task in self.poll_tasks:
+            if task.get_name() == device_key:
+                task.cancel()
+
+        self.poll_tasks[:] = [
+            task for task in self.poll_tasks if task.get_name() != device_key
+        ]
+
+        self.bacnet_device_dict.pop(device_key, None)
+        self.bacnet_property_metadata.pop(device_key, None)
+        self.snapshot_revisions.pop(device_key, None)
+        self.explored_devices.discard(device_identifier[1])
+        self.failed_devices.discard(device_identifier[1])
+        self.device_last_seen.pop(device_identifier[1], None)
+        self.device_missed_rounds.pop(device_identifier[1], None)
+
+        for key in [key for key in self.cov_health if key[0] == device_key]:
+            self.cov_health.pop(key, None)
+
+        self.subscription_manager.forget_device(device_identifier[1])
+
+        self.update_event.set()
+
+    def device_moved(
+        self, device_identifier: ObjectIdentifier, old_address: Address, address: Address
+    ) -> None:
+        """Handle a device that sent an I Am from another address.
+
+        Polls, writes and subscriptions are kept per device and look up the address on each request,
+        so they use the new address from now on. Subscriptions get renewed at the new address right
+        away, as the device may have restarted and lost them.
+        """
+        self.discovery_event(
+            "moved",
+            device_identifier,
+            address=str(address),
+            old_address=str(old_address),
+        )
+
+        self.subscription_manager.device_moved(device_identifier[1])
+
+    def discovery_event(
+        self, event: str, device_identifier: ObjectIdentifier, **details
+    ) -> None:
+        """Report a new, moved or vanished device."""
+        device_key = self.identifier_to_string(ObjectIdentifier(device_identifier))
+
+        LOGGER.info(f"Device {event}: {device_key} {details if details else ''}")
+
+        self.discovery_events.append(
+            {
+                "event": event,
+                "device": device_key,
+                "time": datetime.now().isoformat(timespec="seconds"),
+                **details,
+            }
+        )
+
+    def discovery_status(self) -> dict:
+        """Progress of exploring devices that sent an I Am."""
+        return {
+            "mode": self.discovery_mode,
+            "ranges_covered": len(self.who_is_ranges),
+            "ranges_total": self.who_is_max_instance // self.who_is_range_size + 1,
+            "workers": self.discovery_workers,
+            "queued": self.i_am_queue.qsize(),
+            "exploring": sorted(
+                f"device:{device_id}" for device_id in self.exploring_devices
+            ),
+            "explored": len(self.explored_devices),
+            "failed": sorted(f"device:{device_id}" for device_id in self.failed_devices),
+        }
+
     async def IAm_handler(self):
-        """Do the things when receiving I Am requests"""
+        """Do the things when receiving I Am requests.
+
+        A few of these run side by side, so devices get explored in parallel.
+        """
 
         while True:
+            device_id = None
             try:
                 apdu = await self.i_am_queue.get()
 
                 device_id = apdu.iAmDeviceIdentifier[1]
 
-                # if failed stop handling response
-                if not await self.read_multiple_device_props(apdu=apdu):
-                    LOGGER.warning(f"Failed to get: {device_id}, {device_id}")
-                    if self.bacnet_device_dict.get(f"device:{device_id}"):
-                        self.bacnet_device_dict.pop(f"device:{device_id}")
-                    continue
+                self.exploring_devices.add(device_id)
 
-                if not self.bacnet_device_dict.get(f"device:{device_id}"):
-                    LOGGER.warning(f"Failed to get: {device_id}")
+                if not await self.snapshot_is_valid(
+                    apdu
+                ) and not await self.explore_device(apdu):
+                    self.failed_devices.add(device_id)
                     continue
 
-                if not self.bacnet_device_dict[f"device:{device_id}"].get(
-                    f"device:{device_id}"
-                ):
-                    LOGGER.warning(f"Failed to get: {device_id}, {device_id}")
-                    continue
-
-                services_supported = self.bacnet_device_dict[f"device:{device_id}"][
-                    f"device:{device_id}"
-                ].get("protocolServicesSupported", ServicesSupported())
+                self.failed_devices.discard(device_id)
+                self.explored_devices.add(device_id)
 
-                if services_supported["read-property-multiple"] == 1:
-                    await self.read_multiple_objects(
-                        device_identifier=apdu.iAmDeviceIdentifier
-                    )
-                else:
-                    await self.read_objects(device_identifier=apdu.iAmDeviceIdentifier)
+                LOGGER.info(
+                    f"Explored {apdu.iAmDeviceIdentifier}: {len(self.explored_devices)} explored, {len(self.exploring_devices) - 1} exploring, {self.i_am_queue.qsize()} queued"
+                )
 
                 if self.addon_device_config:
                     await self.generate_specific_tasks(
@@ -719,13 +1399,22 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
             except Exception as err:
                 LOGGER.error(f"I Am Handler failed {apdu.iAmDeviceIdentifier}: {err}")
 
+            finally:
+                self.exploring_devices.discard(device_id)
+                self.i_am_pending.discard(device_id)
+
     def dict_updater(
         self,
         device_identifier: ObjectIdentifier,
         object_identifier: ObjectIdentifier,
         property_identifier: PropertyIdentifier,
         property_value,
+        source: str = "read",
     ):
+        """Store a property value in the device dict and tag when and where it came from.
+
+        source is one of "read", "poll", "cov" or "write".
+        """
         if isinstance(property_value, ErrorType):
             return
         elif property_value is None or property_identifier is None:
@@ -812,16 +1501,129 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                 },
             )
         else:
-            self.deep_update(
-                self.bacnet_device_dict,
-                {
-                    f"{device_identifier[0]}:{device_identifier[1]}": {
-                        f"{object_identifier[0].attr}:{object_identifier[1]}": {
-                            property_identifier.attr: property_value
-                        }
-                    }
-                },
-            )
+            self.deep_update(
+                self.bacnet_device_dict,
+                {
+                    f"{device_identifier[0]}:{device_identifier[1]}": {
+                        f"{object_identifier[0].attr}:{object_identifier[1]}": {
+                            property_identifier.attr: property_value
+                        }
+                    }
+                },
+            )
+
+        self.bacnet_property_metadata.setdefault(
+            f"{device_identifier[0]}:{device_identifier[1]}", {}
+        ).setdefault(f"{object_identifier[0].attr}:{object_identifier[1]}", {})[
+            property_identifier.attr
+        ] = (time.monotonic(), source)
+
+        # every stored value came from the device, it's alive even if it misses a Who Is
+        self.device_seen(device_identifier[1])
+
+    def get_property_metadata(
+        self,
+        device_identifier: ObjectIdentifier,
+        object_identifier: ObjectIdentifier,
+        property_identifier: PropertyIdentifier | str = "presentValue",
+    ) -> tuple[float, str] | None:
+        """Return (monotonic timestamp, source) of the last update of a property."""
+        device_identifier = ObjectIdentifier(device_identifier)
+        object_identifier = ObjectIdentifier(object_identifier)
+        property_identifier = PropertyIdentifier(property_identifier)
+
+        return (
+            self.bacnet_property_metadata.get(
+                f"{device_identifier[0]}:{device_identifier[1]}", {}
+            )
+            .get(f"{object_identifier[0].attr}:{object_identifier[1]}", {})
+            .get(property_identifier.attr)
+        )
+
+    def property_age(
+        self,
+        device_identifier: ObjectIdentifier,
+        object_identifier: ObjectIdentifier,
+        property_identifier: PropertyIdentifier | str = "presentValue",
+    ) -> float | None:
+        """Seconds since a property was last updated, None if never."""
+        metadata = self.get_property_metadata(
+            device_identifier, object_identifier, property_identifier
+        )
+        if not metadata:
+            return None
+        return time.monotonic() - metadata[0]
+
+    def is_fresh_from_cov(
+        self,
+        device_identifier: ObjectIdentifier,
+        object_identifier: ObjectIdentifier,
+        max_age: float,
+    ) -> bool:
+        """Whether the presentValue of an object got delivered by CoV within max_age seconds."""
+        metadata = self.get_property_metadata(device_identifier, object_identifier)
+        if not metadata:
+            return False
+        timestamp, source = metadata
+        return source == "cov" and time.monotonic() - timestamp < max_age
+
+    def cov_suppresses_poll(
+        self,
+        device_identifier: ObjectIdentifier,
+        object_identifier: ObjectIdentifier,
+    ) -> bool:
+        """Whether an active CoV subscription that notified recently makes polling an object unnecessary."""
+        device_identifier = ObjectIdentifier(device_identifier)
+        object_identifier = ObjectIdentifier(object_identifier)
+
+        key = (
+            self.identifier_to_string(device_identifier),
+            self.identifier_to_string(object_identifier),
+        )
+
+        last_notification = self.cov_health.get(key)
+
+        if last_notification is None:
+            return False
+
+        config = self.get_config_from_addon_config(device_identifier)
+
+        quiet_limit = config.get(
+            "CoV_quiet_limit",
+            2 * config.get("CoV_lifetime", self.default_subscription_lifetime),
+        )
+
+        if time.monotonic() - last_notification < quiet_limit:
+            self.cov_quiet.discard(key)
+            return True
+
+        if key not in self.cov_quiet:
+            self.cov_quiet.add(key)
+            LOGGER.info(
+                f"CoV of {device_identifier}, {object_identifier} quiet for over {quiet_limit}s, polling again"
+            )
+
+        return False
+
+    def metadata_to_dict(self, device_key: str | None = None) -> dict:
+        """Return property metadata as JSON friendly age in seconds and source."""
+        now = time.monotonic()
+
+        if device_key:
+            devices = {device_key: self.bacnet_property_metadata.get(device_key, {})}
+        else:
+            devices = self.bacnet_property_metadata
+
+        return {
+            device: {
+                obj: {
+                    prop: {"age": round(now - timestamp, 1), "source": source}
+                    for prop, (timestamp, source) in properties.items()
+                }
+                for obj, properties in objects.items()
+            }
+            for device, objects in devices.items()
+        }
 
     async def read_multiple_device_props(self, apdu) -> bool:
         try:  # Send readPropertyMultiple and get response
@@ -920,10 +1722,17 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
             return False
 
     async def read_object_list_property(self, device_identifier) -> bool:
-        """Read object list property in the smallest possible way."""
+        """Read object list property by array index in a windowed pipeline.
+
+        Indexes get packed into ReadPropertyMultiple requests when the device supports it.
+        The amount of requests in flight grows while the device keeps up and halves on errors.
+        Indexes already read are kept, so after a timeout the next attempt resumes where it stopped.
+        """
         address = self.dev_to_addr(dev=device_identifier)
 
-        LOGGER.debug(f"Reading objectList property of {device_identifier} one by one.")
+        device_key = f"device:{device_identifier[1]}"
+
+        LOGGER.debug(f"Reading objectList property of {device_identifier} by index.")
 
         try:
             object_amount = await self.read_property(
@@ -941,39 +1750,329 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
             )
             return False
 
-        object_list = []
+        progress = self.object_list_progress.get(device_key)
 
-        try:
-            for number in range(1, object_amount + 1):
-                object_type = await self.read_property(
+        if not progress or progress["length"] != object_amount:
+            progress = {"length": object_amount, "objects": {}}
+            self.object_list_progress[device_key] = progress
+        else:
+            LOGGER.info(
+                f"Resuming objectList of {device_identifier} at {len(progress['objects'])}/{object_amount}"
+            )
+
+        device_properties = self.bacnet_device_dict.get(device_key, {}).get(
+            device_key, {}
+        )
+
+        use_read_multiple = (
+            device_properties.get("protocolServicesSupported", ServicesSupported())[
+                "read-property-multiple"
+            ]
+            == 1
+        )
+
+        # an objectIdentifier takes about 10 bytes in a response
+        chunk_size = max(
+            1,
+            min(
+                self.object_list_chunk_size,
+                (int(device_properties.get("maxApduLengthAccepted", 480)) - 20) // 10,
+            ),
+        )
+
+        window = self.object_list_window.get(device_key, 2)
+
+        for _ in range(self.object_list_rounds):
+            pending = [
+                index
+                for index in range(1, object_amount + 1)
+                if index not in progress["objects"]
+            ]
+
+            if not pending:
+                break
+
+            size = chunk_size if use_read_multiple else 1
+
+            chunks = [
+                pending[index : index + size] for index in range(0, len(pending), size)
+            ]
+
+            in_flight: dict = {}
+            failed = False
+
+            try:
+                while chunks or in_flight:
+                    while chunks and len(in_flight) < window and not failed:
+                        chunk = chunks.pop(0)
+                        task = asyncio.create_task(
+                            self.read_object_list_chunk(
+                                address, device_identifier, chunk, use_read_multiple
+                            )
+                        )
+                        in_flight[task] = chunk
+
+                    if not in_flight:
+                        break
+
+                    done, _ = await asyncio.wait(
+                        in_flight, return_when=asyncio.FIRST_COMPLETED
+                    )
+
+                    for task in done:
+                        chunk = in_flight.pop(task)
+                        try:
+                            progress["objects"].update(task.result())
+                        except (ErrorRejectAbortNack, Exception) as err:
+                            LOGGER.warning(
+                                f"Error reading objectList[{chunk[0]}..{chunk[-1]}] of {device_identifier}: {err}"
+                            )
+                            failed = True
+                            window = max(1, window // 2)
+
+                            if use_read_multiple and (
+                                "unrecognized-service" in str(err)
+                                or "segmentation-not-supported" in str(err)
+                            ):
+                                use_read_multiple = False
+                        else:
+                            window = min(self.object_list_max_window, window + 1)
+            finally:
+                # don't leave reads running when a round ends early
+                for task in in_flight:
+                    task.cancel()
+                await asyncio.gather(*in_flight, return_exceptions=True)
+
+            self.object_list_window[device_key] = window
+
+        if len(progress["objects"]) < object_amount:
+            LOGGER.warning(
+                f"Read {len(progress['objects'])}/{object_amount} objectList entries of {device_identifier}, resuming next time"
+            )
+            return False
+
+        object_list = [
+            progress["objects"][index] for index in range(1, object_amount + 1)
+        ]
+
+        self.object_list_progress.pop(device_key, None)
+
+        self.dict_updater(
+            device_identifier=device_identifier,
+            object_identifier=device_identifier,
+            property_identifier=PropertyIdentifier("objectList"),
+            property_value=object_list,
+        )
+
+        return True
+
+    async def read_object_list_chunk(
+        self,
+        address: Address,
+        device_identifier: ObjectIdentifier,
+        indexes: list[int],
+        use_read_multiple: bool,
+    ) -> dict[int, ObjectIdentifier]:
+        """Read a few indexes of the object list, in one request if possible."""
+        if not use_read_multiple:
+            return {
+                index: await self.read_property(
                     address=address,
                     objid=device_identifier,
                     prop=PropertyIdentifier("objectList"),
-                    array_index=number,
+                    array_index=index,
                 )
-                object_list.append(object_type)
+                for index in indexes
+            }
+
+        response = await self.read_property_multiple(
+            address=address,
+            parameter_list=[
+                device_identifier,
+                [f"objectList[{index}]" for index in indexes],
+            ],
+        )
 
-            self.dict_updater(
-                device_identifier=device_identifier,
-                object_identifier=device_identifier,
-                property_identifier=PropertyIdentifier("objectList"),
-                property_value=object_list,
+        return {
+            property_array_index: property_value
+            for (
+                object_identifier,
+                property_identifier,
+                property_array_index,
+                property_value,
+            ) in response
+            if isinstance(property_value, ObjectIdentifier)
+        }
+
+    async def read_batch(
+        self,
+        points: list[tuple],
+        max_age: float | None = None,
+    ) -> list[tuple]:
+        """Read (device, object, property, array index) points, grouped per device.
+
+        Points updated within max_age seconds are served from the device dict.
+        Returns (value or error, "cache" or "read") for each point, in the same order.
+        """
+        results: list = [None] * len(points)
+        to_read: dict[int, list[int]] = {}
+
+        for index, (
+            device_identifier,
+            object_identifier,
+            property_identifier,
+            array_index,
+        ) in enumerate(points):
+            age = self.property_age(
+                device_identifier, object_identifier, property_identifier
             )
-        except ErrorRejectAbortNack as err:
-            LOGGER.warning(
-                f"Error getting object list size for {device_identifier} at {address}: {err}"
+
+            # metadata can outlive the value, e.g. while a device is explored again
+            cached = self.bacnet_device_dict.get(
+                self.identifier_to_string(device_identifier), {}
+            ).get(self.identifier_to_string(object_identifier), {})
+
+            if (
+                max_age is not None
+                and array_index is None
+                and age is not None
+                and age <= max_age
+                and property_identifier.attr in cached
+            ):
+                results[index] = (cached[property_identifier.attr], "cache")
+                continue
+
+            to_read.setdefault(device_identifier[1], []).append(index)
+
+        await asyncio.gather(
+            *(
+                self.read_device_batch(points, indexes, results)
+                for indexes in to_read.values()
             )
-            return False
-        else:
-            return True
+        )
+
+        return results
+
+    async def read_device_batch(
+        self, points: list[tuple], indexes: list[int], results: list
+    ) -> None:
+        """Read points of one device, packed in ReadPropertyMultiple requests where supported."""
+        device_identifier = points[indexes[0]][0]
+        device_key = self.identifier_to_string(device_identifier)
+        address = self.dev_to_addr(device_identifier)
+
+        if address is None:
+            for index in indexes:
+                results[index] = (ValueError(f"unknown device {device_key}"), "read")
+            return
+
+        device_properties = self.bacnet_device_dict.get(device_key, {}).get(
+            device_key, {}
+        )
+
+        if (
+            device_properties.get("protocolServicesSupported", ServicesSupported())[
+                "read-property-multiple"
+            ]
+            == 1
+        ):
+            # a property value takes about 20 bytes in a response
+            chunk_size = max(
+                1, (int(device_properties.get("maxApduLengthAccepted", 480)) - 20) // 20
+            )
+
+            for start in range(0, len(indexes), chunk_size):
+                chunk = indexes[start : start + chunk_size]
+                references: dict = {}
+
+                for index in chunk:
+                    _, object_identifier, property_identifier, array_index = points[
+                        index
+                    ]
+                    references.setdefault(object_identifier, []).append(
+                        f"{property_identifier.attr}[{array_index}]"
+                        if array_index is not None
+                        else property_identifier.attr
+                    )
+
+                parameter_list: list = []
+                for object_identifier, property_references in references.items():
+                    parameter_list.extend([object_identifier, property_references])
+
+                try:
+                    response = await self.read_property_multiple(
+                        address=address, parameter_list=parameter_list
+                    )
+                except ErrorRejectAbortNack as err:
+                    LOGGER.warning(
+                        f"Batch read of {device_identifier} failed, reading one by one: {err}"
+                    )
+                    continue
+
+                values = {
+                    (object_identifier, property_identifier, property_array_index): value
+                    for (
+                        object_identifier,
+                        property_identifier,
+                        property_array_index,
+                        value,
+                    ) in response
+                }
+
+                for index in chunk:
+                    key = points[index][1:]
+                    if key in values:
+                        results[index] = (values[key], "read")
+
+        for index in indexes:
+            if results[index] is not None:
+                continue
+
+            _, object_identifier, property_identifier, array_index = points[index]
+
+            try:
+                value = await self.read_property(
+                    address=address,
+                    objid=object_identifier,
+                    prop=property_identifier,
+                    array_index=array_index,
+                )
+            except (ErrorRejectAbortNack, Exception) as err:
+                results[index] = (err, "read")
+                continue
+
+            results[index] = (value, "read")
+
+        for index in indexes:
+            value, _ = results[index]
+            _, object_identifier, property_identifier, array_index = points[index]
+            if isinstance(value, (ErrorRejectAbortNack, Exception, ErrorType)):
+                # an error for this property, not a value to store
+                continue
+            if array_index is None:
+                self.dict_updater(
+                    device_identifier=device_identifier,
+                    object_identifier=object_identifier,
+                    property_identifier=property_identifier,
+                    property_value=value,
+                )
+                # answer with the value as it's stored, the same as served from cache
+                results[index] = (
+                    self.bacnet_device_dict.get(device_key, {})
+                    .get(self.identifier_to_string(object_identifier), {})
+                    .get(property_identifier.attr, value),
+                    "read",
+                )
 
-    async def read_multiple_objects(self, device_identifier):
-        """Read all objects from a device."""
+    async def read_multiple_objects(self, device_identifier, object_list=None):
+        """Read all objects from a device, or only the ones in object_list."""
         LOGGER.info(f"Reading objects from objectList of {device_identifier}...")
         device_identifier = ObjectIdentifier(device_identifier)
-        for obj_id in self.bacnet_device_dict[f"device:{device_identifier[1]}"][
-            f"device:{device_identifier[1]}"
-        ]["objectList"]:
+        if object_list is None:
+            object_list = self.bacnet_device_dict[f"device:{device_identifier[1]}"][
+                f"device:{device_identifier[1]}"
+            ]["objectList"]
+        for obj_id in object_list:
             if not isinstance(obj_id, ObjectIdentifier):
                 obj_id = ObjectIdentifier(obj_id)
 
@@ -998,10 +2097,10 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                 )
 
                 if "unrecognized-service" in str(err):
-                    await self.read_objects(device_identifier)
+                    await self.read_objects(device_identifier, object_list)
                     return
                 elif "segmentation-not-supported" in str(err):
-                    await self.read_objects(device_identifier)
+                    await self.read_objects(device_identifier, object_list)
                     return
                 elif "no-response" in str(err):
                     return False
@@ -1030,11 +2129,13 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                             property_value=property_value,
                         )
 
-    async def read_objects(self, device_identifier):
+    async def read_objects(self, device_identifier, object_list=None):
         try:
-            for obj_id in self.bacnet_device_dict[f"device:{device_identifier[1]}"][
-                f"device:{device_identifier[1]}"
-            ].get("objectList", []):
+            if object_list is None:
+                object_list = self.bacnet_device_dict[
+                    f"device:{device_identifier[1]}"
+                ][f"device:{device_identifier[1]}"].get("objectList", [])
+            for obj_id in object_list:
                 if not isinstance(obj_id, ObjectIdentifier):
                     obj_id = ObjectIdentifier(obj_id)
 
@@ -1138,6 +2239,7 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                             object_identifier=object_identifier,
                             property_identifier=property_identifier,
                             property_value=property_value,
+                            source="poll",
                         )
 
     async def read_objects_periodically(self, device_identifier):
@@ -1190,6 +2292,7 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
                             object_identifier=obj_id,
                             property_identifier=property_id,
                             property_value=response,
+                            source="poll",
                         )
 
     async def subscribe_object_list(self, device_identifier):
@@ -1211,212 +2314,60 @@ class BACnetIOHandler(NormalApplication, ForeignApplication):
         confirmed_notifications: bool,
         lifetime: int | None = None,
     ):
-        device_address = self.dev_to_addr(ObjectIdentifier(device_identifier))
+        """Hand a subscription to the subscription manager."""
+        device_identifier = ObjectIdentifier(device_identifier)
+        object_identifier = ObjectIdentifier(object_identifier)
+
         if confirmed_notifications:
             notifications = "confirmed"
         else:
             notifications = "unconfirmed"
 
-        object_identifier = ObjectIdentifier(object_identifier)
-
         LOGGER.debug(
-            f"Creating {notifications} subscription task {object_identifier} of {device_identifier}"
+            f"Creating {notifications} subscription {object_identifier} of {device_identifier}"
         )
 
-        task = asyncio.create_task(
-            self.subscription_task(
-                device_address=device_address,
-                object_identifier=ObjectIdentifier(object_identifier),
-                confirmed_notification=confirmed_notifications,
-                lifetime=lifetime,
-            ),
-            name=f"{device_identifier[0].attr}:{device_identifier[1]},{object_identifier[0].attr}:{object_identifier[1]},{notifications}",
+        self.subscription_manager.subscribe(
+            device_identifier=device_identifier,
+            object_identifier=object_identifier,
+            confirmed=confirmed_notifications,
+            lifetime=lifetime,
         )
-        await asyncio.sleep(0.1)
-        self.subscription_tasks.append(task)
-
-    async def subscription_task(
-        self,
-        device_address: Address,
-        object_identifier: ObjectIdentifier,
-        confirmed_notification: bool,
-        lifetime: int | None = None,
-    ) -> None:
-        """Task with context manager to handle CoV."""
-
-        device_identifier = self.addr_to_dev(addr=device_address)
-
-        if confirmed_notification:
-            notifications = "confirmed"
-        else:
-            notifications = "unconfirmed"
-
-        task_name = f"{device_identifier[0].attr}:{device_identifier[1]},{object_identifier[0].attr}:{object_identifier[1]},{notifications}"
-
-        unsubscribe_cov_request = None
-
-        try:
-            async with self.change_of_value(
-                address=device_address,
-                monitored_object_identifier=object_identifier,
-                subscriber_process_identifier=None,
-                issue_confirmed_notifications=confirmed_notification,
-                lifetime=lifetime,
-            ) as subscription:
-                # create a request to cancel the subscription
-                unsubscribe_cov_request = SubscribeCOVRequest(
-                    subscriberProcessIdentifier=subscription.subscriber_process_identifier,
-                    monitoredObjectIdentifier=subscription.monitored_object_identifier,
-                    destination=subscription.address,
-                )
-
-                unsubscribe_cov_request.pduDestination = device_address
-
-                LOGGER.debug(f"Created {task_name} subscription task successfully")
-
-                while True:
-                    try:
-                        property_identifier, property_value = await asyncio.wait_for(
-                            subscription.get_value(), 10
-                        )
-                    except asyncio.TimeoutError:
-                        # check if address has changes
-                        if subscription.address != self.dev_to_addr(
-                            dev=device_identifier
-                        ):
-                            old_key = (
-                                subscription.address,
-                                subscription.subscriber_process_identifier,
-                            )
-                            self._cov_contexts.pop(old_key)
-
-                            subscription.address = self.dev_to_addr(
-                                dev=device_identifier
-                            )
-
-                            new_key = (
-                                subscription.address,
-                                subscription.subscriber_process_identifier,
-                            )
-
-                            self._cov_contexts[new_key] = subscription
-
-                        if not isinstance(
-                            subscription.refresh_subscription_task, asyncio.Task
-                        ):
-                            continue
-
-                        if subscription.refresh_subscription_task.done():
-                            # check for exceptions (gets raised by result if there is)
-                            subscription.refresh_subscription_task.result()
-
-                        continue
-
-                    except Exception:
-                        raise
-
-                    object_class = self.vendor_info.get_object_class(
-                        subscription.monitored_object_identifier[0]
-                    )
-                    property_type = object_class.get_property_type(property_identifier)
-
-                    if property_type is None or property_value is None:
-                        LOGGER.warning(
-                            f"NoneType property: {subscription.monitored_object_identifier} {property_identifier} {property_value}"
-                        )
-                        continue
-                    elif property_identifier not in object_properties_to_read_once:
-                        LOGGER.warning(
-                            f"Ignoring property: {subscription.monitored_object_identifier[0]} {property_identifier} {property_value}"
-                        )
-                        continue
-
-                    LOGGER.debug(
-                        f"{notifications} CoV: {device_identifier} {object_identifier} {property_identifier} {property_value}"
-                    )
-
-                    self.dict_updater(
-                        device_identifier=device_identifier,
-                        object_identifier=object_identifier,
-                        property_identifier=property_identifier,
-                        property_value=property_value,
-                    )
-
-        except ErrorRejectAbortNack as err:
-            LOGGER.error(
-                f"ErrorRejectAbortNack: {self.addr_to_dev(device_address)}, {object_identifier}: {err}"
-            )
-
-            for task in self.subscription_tasks:
-                if task_name in task.get_name():
-                    index = self.subscription_tasks.index(task)
-                    self.subscription_tasks.pop(index)
-
-        except AbortPDU as err:
-            LOGGER.error(f"{err}")
-
-        except asyncio.CancelledError as err:
-            LOGGER.error(
-                f"Cancelling subscription task: {device_identifier}, {object_identifier}: {err}"
-            )
-
-            # send the request, wait for the response
-            if unsubscribe_cov_request:
-                response = await self.request(unsubscribe_cov_request)
-
-            for task in self.subscription_tasks:
-                if task_name in task.get_name():
-                    index = self.subscription_tasks.index(task)
-                    self.subscription_tasks.pop(index)
-
-        except Exception as err:
-            LOGGER.error(f"Error: {device_identifier}, {object_identifier}: {err}")
-
-            # send the request, wait for the response
-            if unsubscribe_cov_request:
-                response = await self.request(unsubscribe_cov_request)
-
-            for task in self.subscription_tasks:
-                if task_name in task.get_name():
-                    index = self.subscription_tasks.index(task)
-                    self.subscription_tasks.pop(index)
+        # sending is spread out by the subscription manager, just let other tasks run
+        await asyncio.sleep(0)
 
     async def end_subscription_tasks(self):
-        for task in self.subscription_tasks:
-            task.cancel()
-        while self.subscription_tasks:
-            await asyncio.sleep(2)
-        LOGGER.info("Cancelled all subscriptions")
+        await self.subscription_manager.stop()
 
     async def do_ConfirmedCOVNotificationRequest(
         self, apdu: ConfirmedCOVNotificationRequest
     ) -> None:
 
-        address = apdu.pduSource
-        subscriber_process_identifier = apdu.subscriberProcessIdentifier
-
-        # find the context
-        scm = self._cov_contexts.get((address, subscriber_process_identifier), None)
-
-        if not scm:
-            await asyncio.sleep(0.1)
-            scm = self._cov_contexts.get((address, subscriber_process_identifier), None)
-
-        if (not scm) or (
-            apdu.monitoredObjectIdentifier != scm.monitored_object_identifier
-        ):
+        if not await self.subscription_manager.handle_notification(apdu):
             raise ServicesError(errorCode="unknownSubscription")
 
-        # queue the property values
-        for property_value in apdu.listOfValues:
-            await scm.put(property_value)
-
         # success
         resp = SimpleAckPDU(context=apdu)
 
         # return the result
         await self.response(resp)
 
+    async def do_ConfirmedCOVNotificationMultipleRequest(
+        self, apdu: ConfirmedCOVNotificationMultipleRequest
+    ) -> None:
+        if not await self.subscription_manager.handle_notification_multiple(apdu):
+            raise ServicesError(errorCode="unknownSubscription")
+
+        await self.response(SimpleAckPDU(context=apdu))
+
+    async def do_UnconfirmedCOVNotificationRequest(
+        self, apdu: UnconfirmedCOVNotificationRequest
+    ) -> None:
+        if not await self.subscription_manager.handle_notification(apdu):
+            LOGGER.debug(
+                f"Unknown unconfirmed CoV notification from {apdu.pduSource}: {apdu.monitoredObjectIdentifier}"
+            )
+
     async def do_ReadPropertyRequest(self, apdu: ReadPropertyRequest) -> None:
         try:
             await super().do_ReadPropertyRequest(apdu)
@@ -1556,45 +2507,75 @@ class ObjectManager:
         self.app = app
         self.api_token = api_token
         self.entity_list = entity_list
+        self.client = HomeAssistantClient(api_token=api_token)
+        self.setup_task: asyncio.Task | None = None
+        self.tasks: list[asyncio.Task] = []
 
         if not self.api_token:
             return None
 
-        self.services = self.fetch_services()
+        # fetching runs alongside BACnet instead of holding up the event loop
+        self.setup_task = asyncio.create_task(self.setup())
+        self.setup_task.add_done_callback(self.setup_done)
+
+    def setup_done(self, task: asyncio.Task) -> None:
+        """Report a failed setup right away instead of when closing."""
+        if task.cancelled() or task.exception() is None:
+            return
+        LOGGER.error(f"Setting up Home Assistant objects failed: {task.exception()}")
+
+    async def setup(self) -> None:
+        """Fetch the services and entities and turn the entities into objects."""
+        self.services = await self.fetch_services()
 
         if not self.entity_list:
             return None
 
-        self.process_entity_list(entity_list=entity_list)
+        await self.process_entity_list(entity_list=self.entity_list)
+
+        for object_type, entity_ids in (
+            ("binaryValue", self.binary_val_entity_ids),
+            ("binaryInput", self.binary_in_entity_ids),
+            ("analogValue", self.analog_val_entity_ids),
+            ("analogInput", self.analog_in_entity_ids),
+            ("characterstringValue", self.char_string_val_entity_ids),
+        ):
+            entities = await asyncio.gather(
+                *(self.fetch_entity_data(entity) for entity in entity_ids)
+            )
 
-        for index, entity in enumerate(self.binary_val_entity_ids):
-            data = self.fetch_entity_data(entity)
-            self.add_object(object_type="binaryValue", index=index, entity=data)
+            for index, data in enumerate(entities):
+                if not data:
+                    LOGGER.warning(
+                        f"No data for {entity_ids[index]}, {object_type}:{index} not created"
+                    )
+                    continue
+                self.add_object(object_type=object_type, index=index, entity=data)
 
-        for index, entity in enumerate(self.binary_in_entity_ids):
-            data = self.fetch_entity_data(entity)
-            self.add_object(object_type="binaryInput", index=index, entity=data)
+        self.tasks.append(asyncio.create_task(self.data_websocket_task()))
 
-        for index, entity in enumerate(self.analog_val_entity_ids):
-            data = self.fetch_entity_data(entity)
-            self.add_object(object_type="analogValue", index=index, entity=data)
+        self.tasks.append(asyncio.create_task(self.data_write_task()))
 
-        for index, entity in enumerate(self.analog_in_entity_ids):
-            data = self.fetch_entity_data(entity)
-            self.add_object(object_type="analogInput", index=index, entity=data)
+    async def close(self) -> None:
+        """Stop the setup and updater tasks before closing the client they use."""
+        tasks = [task for task in (self.setup_task, *self.tasks) if task]
 
-        for index, entity in enumerate(self.char_string_val_entity_ids):
-            data = self.fetch_entity_data(entity)
-            self.add_object(
-                object_type="characterstringValue", index=index, entity=data
-            )
+        for task in tasks:
+            if not task.done():
+                task.cancel()
 
-        asyncio.create_task(self.data_websocket_task())
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as err:
+                LOGGER.warning(f"Object manager task failed: {err}")
 
-        asyncio.create_task(self.data_write_task())
+        await self.client.close()
 
     @backoff.on_exception(backoff.expo, Exception, max_time=60)
-    def process_entity_list(self, entity_list: list) -> None:
+    async def process_entity_list(self, entity_list: list) -> None:
         """Fill bacnet object list"""
         self.binary_val_entity_ids = []
         self.binary_in_entity_ids = []
@@ -1613,13 +2594,17 @@ class ObjectManager:
             elif split_entity[0] in (
                 "sensor"
             ):  # analog in of character string val wanneer string
-                data = self.fetch_entity_data(entity)
+                data = await self.fetch_entity_data(entity)
+
+                if not data:
+                    LOGGER.warning(f"No data for {entity}, no object created")
+                    continue
 
                 state = data.get("state")
 
                 try:
                     state = float(state)
-                except ValueError:
+                except (TypeError, ValueError):
                     LOGGER.debug(f"state {state} is not a number")
 
                 if isinstance(state, (int, float, complex)):
@@ -1682,39 +2667,19 @@ class ObjectManager:
             ObjectIdentifier(str(object_type + ":" + str(index)))
         )
 
-    def fetch_entity_data(self, entity_id):
+    async def fetch_entity_data(self, entity_id):
         """Fetch data from API."""
-        url = f"http://supervisor/core/api/states/{entity_id}"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "content-type": "application/json",
-        }
-
-        response = requests.get(url, headers=headers)
+        data = await self.client.get(f"states/{entity_id}")
 
-        if response.status_code == 200:
-            return json.loads(response.text)
-        else:
-            LOGGER.error(f"Failed to get {entity_id}. {response.status_code}")
-            return False
+        return data if data is not None else False
 
-    def fetch_services(self):
+    async def fetch_services(self):
         """Fetch data from API."""
-        url = f"http://supervisor/core/api/services"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "content-type": "application/json",
-        }
-
-        response = requests.get(url, headers=headers)
+        data = await self.client.get("services")
 
-        if response.status_code == 200:
-            return json.loads(response.text)
-        else:
-            LOGGER.error(f"Failed to get services. {response.status_code}")
-            return False
+        return data if data is not None else False
 
-    def post_services(self, entity_id, value):
+    async def post_services(self, entity_id, value):
         """Write value to API."""
 
         split_id = entity_id.split(".")
@@ -1740,21 +2705,7 @@ class ObjectManager:
             LOGGER.error(f"Can not write to {entity_id} as it's deemed not writable'")
             return False
 
-        url = f"http://supervisor/core/api/services/{domain}/{service}"
-        headers = {
-            "Authorization": f"Bearer {self.api_token}",
-            "content-type": "application/json",
-        }
-
-        response = requests.post(url, headers=headers, json=data)
-
-        if response.status_code == 200:
-            return True
-        else:
-            LOGGER.error(
-                f"Failed to post {entity_id}: HTTP Code {response.status_code}"
-            )
-            return False
+        return await self.client.post(f"services/{domain}/{service}", data)
 
     def add_object(self, object_type: str, index: int, entity: dict):
         """Add object to application"""
@@ -2035,13 +2986,13 @@ class ObjectManager:
                 else:
                     entity_id = None
 
-                write_response = self.post_services(
+                write_response = await self.post_services(
                     entity_id=entity_id, value=property_value
                 )
 
                 self.app.write_to_api.clear()
 
-                data = self.fetch_entity_data(entity_id)
+                data = await self.fetch_entity_data(entity_id)
 
                 self.update_object(
                     object_type=obj[0].attr, index=entity_index, entity=data
@@ -0,0 +1,80 @@
+"""Home Assistant REST API client for BACnet add-on."""
+
+import asyncio
+
+import aiohttp
+from const import LOGGER
+
+
+class HomeAssistantClient:
+    """Non-blocking client for the Home Assistant REST API behind the supervisor.
+
+    One pooled session is shared by all requests, each request has a timeout and
+    at most max_connections requests run at the same time.
+    """
+
+    def __init__(
+        self,
+        api_token: str,
+        base_url: str = "http://supervisor/core/api",
+        timeout: float = 10,
+        max_connections: int = 4,
+    ) -> None:
+        self.api_token = api_token
+        self.base_url = base_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.session: aiohttp.ClientSession | None = None
+
+    def get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers={
+                    "Authorization": f"Bearer {self.api_token}",
+                    "content-type": "application/json",
+                },
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+        return self.session
+
+    async def request(self, method: str, path: str, **kwargs) -> tuple[int, object]:
+        """Send a request and return the HTTP status with the decoded JSON body."""
+        async with self.semaphore:
+            async with self.get_session().request(
+                method, f"{self.base_url}/{path}", **kwargs
+            ) as response:
+                if response.status != 200:
+                    return response.status, None
+                return response.status, await response.json()
+
+    async def get(self, path: str):
+        """JSON of a GET request, None when it failed."""
+        try:
+            status, data = await self.request("GET", path)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            LOGGER.error(f"Failed to get {path}: {err}")
+            return None
+
+        if status != 200:
+            LOGGER.error(f"Failed to get {path}. {status}")
+
+        return data
+
+    async def post(self, path: str, data: dict) -> bool:
+        try:
+            status, _ = await self.request("POST", path, json=data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            LOGGER.error(f"Failed to post {path}: {err}")
+            return False
+
+        if status != 200:
+            LOGGER.error(f"Failed to post {path}: HTTP Code {status}")
+            return False
+
+        return True
+
+    async def close(self) -> None:
+        if self.session and not self.session.closed:
+            await self.session.close()
@@ -15,15 +15,14 @@ import psutil
 import uvicorn
 import webAPI
 from BACnetIOHandler import BACnetIOHandler, ObjectManager
-from bacpypes3.apdu import AbortPDU, ErrorPDU, RejectPDU
-from bacpypes3.basetypes import (Null, ObjectType, Segmentation,
-                                 ServicesSupported)
+from bacpypes3.basetypes import ObjectType, Segmentation, ServicesSupported
 from bacpypes3.ipv4.app import Application
 from bacpypes3.local.device import DeviceObject
 from bacpypes3.pdu import IPv4Address
 from bacpypes3.primitivedata import ObjectIdentifier
 from const import LOGGER, subscribable_objects
 from webAPI import app as fastapi_app
+from writeEngine import WriteEngine
 
 KeyType = TypeVar("KeyType")
 
@@ -89,71 +88,6 @@ async def updater_task(app: Application, interval: int, event: asyncio.Event) ->
         LOGGER.warning(f"Updater task cancelled: {err}")
 
 
-async def writer_task(
-    app: Application, write_queue: asyncio.Queue, default_write_prio: int
-) -> None:
-    """Task to handle the write queue"""
-    try:
-        while True:
-            queue_result = await write_queue.get()
-            device_id = queue_result[0]
-            object_id = queue_result[1]
-            property_id = queue_result[2]
-            property_val = queue_result[3]
-            array_index = queue_result[4]
-            priority = queue_result[5]
-
-            if not priority:
-                priority = default_write_prio
-
-            if property_val == None:
-                property_val = Null("null")
-
-            LOGGER.debug(
-                f"Writing: {device_id}, {object_id}, {property_id}, {property_val}, {priority}"
-            )
-
-            try:
-                response = await app.write_property(
-                    address=app.dev_to_addr(device_id),
-                    objid=object_id,
-                    prop=property_id,
-                    value=property_val,
-                    array_index=array_index,
-                    priority=priority,
-                )
-            except (AbortPDU, ErrorPDU, RejectPDU) as err:
-                LOGGER.error(f"response: {err}")
-                continue
-            except Exception as err:
-                LOGGER.error(f"response: {err}")
-                continue
-
-            LOGGER.info(f"response: {response if response else 'Acknowledged'}")
-
-            await asyncio.sleep(0.1)
-
-            read = await app.read_property(
-                address=app.dev_to_addr(device_id),
-                objid=object_id,
-                prop=property_id,
-                array_index=array_index,
-            )
-            LOGGER.info(f"Write result: {read}")
-
-            app.dict_updater(
-                device_identifier=device_id,
-                object_identifier=object_id,
-                property_identifier=property_id,
-                property_value=property_val,
-            )
-
-    except Exception as err:
-        LOGGER.error(f" Writer task error: {err}")
-    except asyncio.CancelledError as err:
-        LOGGER.warning(f"Writer task cancelled: {err}")
-
-
 async def subscribe_handler_task(app: Application, sub_queue: asyncio.Queue) -> None:
     """Task to handle the subscribe queue"""
     try:
@@ -361,6 +295,14 @@ async def main():
         ttl=int(foreign_ttl),
         update_event=webAPI.events.val_updated_event,
         addon_device_config=options.get("devices_setup"),
+        warm_start=options.get("warm_start", True),
+        discovery_workers=options.get("discovery_workers", 4),
+        discovery_mode=options.get("discovery_mode", "global"),
+        who_is_range_size=options.get("who_is_range_size", 1000),
+        who_is_rate=options.get("who_is_rate", 5),
+        who_is_max_instance=options.get("who_is_max_instance", 4194302),
+        rediscovery_interval=options.get("rediscovery_interval", 3600),
+        cov_filters=options.get("CoV_filters"),
     )
 
     object_manager = ObjectManager(
@@ -383,14 +325,14 @@ async def main():
         )
     )
 
-    write_task = asyncio.create_task(
-        writer_task(
-            app=app,
-            write_queue=webAPI.events.write_queue,
-            default_write_prio=default_write_prio,
-        )
+    write_engine = WriteEngine(
+        app=app,
+        write_queue=webAPI.events.write_queue,
+        default_priority=default_write_prio,
     )
 
+    write_task = asyncio.create_task(write_engine.run())
+
     sub_task = asyncio.create_task(
         subscribe_handler_task(app=app, sub_queue=webAPI.events.sub_queue)
     )
@@ -401,6 +343,15 @@ async def main():
 
     webAPI.sub_list = app.subscription_tasks
     webAPI.bacnet_device_dict = app.bacnet_device_dict
+    webAPI.metadata_func = app.metadata_to_dict
+    webAPI.discovery_func = app.discovery_status
+    webAPI.discovery_events = app.discovery_events
+    webAPI.write_stats_func = write_engine.stats
+    webAPI.read_batch_func = app.read_batch
+    webAPI.subscription_status_func = app.subscription_manager.status
+    webAPI.delivery_func = app.delivery_modes
+    webAPI.subscription_schedule_func = app.subscription_manager.schedule_status
+    webAPI.subscribe_func = app.subscription_manager.subscribe
     webAPI.who_is_func = app.who_is
     webAPI.i_am_func = app.i_am
     webAPI.events.startup_complete_event = app.startup_complete
@@ -424,6 +375,9 @@ async def main():
         sub_task.cancel()
         unsub_task.cancel()
         await app.end_subscription_tasks()
+        await object_manager.close()
+        if app.warm_start:
+            await app.save_snapshot()
         app.close()
 
 
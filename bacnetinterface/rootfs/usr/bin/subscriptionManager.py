@@ -0,0 +1,1452 @@
+"""CoV subscription manager for BACnet add-on."""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+
+from bacpypes3.apdu import (ConfirmedRequestSequence, ConfirmedServiceChoice,
+                            ErrorRejectAbortNack, SubscribeCOVRequest,
+                            register_confirmed_request_type)
+from bacpypes3.basetypes import (DateTime, PropertyIdentifier,
+                                 PropertyReference, ServicesSupported)
+from bacpypes3.constructeddata import Any, Sequence, SequenceOf
+from bacpypes3.primitivedata import (Boolean, ObjectIdentifier, Real, Time,
+                                     Unsigned)
+from const import LOGGER, object_properties_to_read_once
+from writeEngine import describe_error
+
+# errors of a device that has no room for more subscriptions
+capacity_error_codes = (
+    "noSpaceToAddListElement",
+    "noSpaceForObject",
+    "noSpaceToWriteProperty",
+    "resourcesOther",
+)
+
+# ===================================================
+# SubscribeCOVPropertyMultiple, not implemented by bacpypes3 yet
+# ===================================================
+
+
+class COVReference(Sequence):
+    _order = ("monitoredProperty", "covIncrement", "timestamped")
+    monitoredProperty = PropertyReference(_context=0)
+    covIncrement = Real(_context=1, _optional=True)
+    timestamped = Boolean(_context=2)
+
+
+class COVSubscriptionSpecification(Sequence):
+    _order = ("monitoredObjectIdentifier", "listOfCOVReferences")
+    monitoredObjectIdentifier = ObjectIdentifier(_context=0)
+    listOfCOVReferences = SequenceOf(COVReference, _context=1)
+
+
+@register_confirmed_request_type
+class SubscribeCOVPropertyMultipleRequest(ConfirmedRequestSequence):
+    service_choice = ConfirmedServiceChoice.subscribeCOVPropertyMultiple
+    _order = (
+        "subscriberProcessIdentifier",
+        "issueConfirmedNotifications",
+        "lifetime",
+        "maxNotificationDelay",
+        "listOfCOVSubscriptionSpecifications",
+    )
+    subscriberProcessIdentifier = Unsigned(_context=0)
+    issueConfirmedNotifications = Boolean(_context=1, _optional=True)
+    lifetime = Unsigned(_context=2, _optional=True)
+    maxNotificationDelay = Unsigned(_context=3, _optional=True)
+    listOfCOVSubscriptionSpecifications = SequenceOf(
+        COVSubscriptionSpecification, _context=4
+    )
+
+
+class COVNotificationValue(Sequence):
+    _order = ("propertyIdentifier", "propertyArrayIndex", "value", "timeOfChange")
+    propertyIdentifier = PropertyIdentifier(_context=0)
+    propertyArrayIndex = Unsigned(_context=1, _optional=True)
+    value = Any(_context=2)
+    timeOfChange = Time(_context=3, _optional=True)
+
+
+class COVNotification(Sequence):
+    _order = ("monitoredObjectIdentifier", "listOfValues")
+    monitoredObjectIdentifier = ObjectIdentifier(_context=0)
+    listOfValues = SequenceOf(COVNotificationValue, _context=1)
+
+
+@register_confirmed_request_type
+class ConfirmedCOVNotificationMultipleRequest(ConfirmedRequestSequence):
+    service_choice = ConfirmedServiceChoice.confirmedCOVNotificationMultiple
+    _order = (
+        "subscriberProcessIdentifier",
+        "initiatingDeviceIdentifier",
+        "timeRemaining",
+        "timestamp",
+        "listOfCOVNotifications",
+    )
+    subscriberProcessIdentifier = Unsigned(_context=0)
+    initiatingDeviceIdentifier = ObjectIdentifier(_context=1)
+    timeRemaining = Unsigned(_context=2)
+    timestamp = DateTime(_context=3, _optional=True)
+    listOfCOVNotifications = SequenceOf(COVNotification, _context=4)
+
+
+# properties a SubscribeCOV notifies about, used for SubscribeCOVPropertyMultiple as well
+cov_properties: list = ["presentValue", "statusFlags"]
+
+
+@dataclass(eq=False)
+class Subscription:
+    """A CoV subscription to one object of a device."""
+
+    manager: "SubscriptionManager" = field(repr=False)
+    device_identifier: ObjectIdentifier
+    object_identifier: ObjectIdentifier
+    confirmed: bool
+    lifetime: int | None
+    process_identifier: int | None = None
+    group: "SubscriptionGroup | None" = field(default=None, repr=False)
+    status: str = "pending"
+    expires: float | None = None
+    renew_at: float | None = None
+    last_notification: float | None = None
+    notifications: int = 0
+    retry_delay: float = 0
+    settled: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+    deadband: float = 0
+    min_interval: float = 0
+    delivered: dict = field(default_factory=dict, repr=False)
+    delivered_at: float | None = None
+    held: dict = field(default_factory=dict, repr=False)
+    flush_handle: asyncio.TimerHandle | None = field(default=None, repr=False)
+    filtered: int = 0
+    created: float = field(default_factory=time.monotonic, repr=False)
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (
+            f"{self.device_identifier[0].attr}:{self.device_identifier[1]}",
+            f"{self.object_identifier[0].attr}:{self.object_identifier[1]}",
+        )
+
+    def get_name(self) -> str:
+        """Named like the subscription tasks used to be, "device:1,analogInput:1,confirmed"."""
+        notifications = "confirmed" if self.confirmed else "unconfirmed"
+        return f"{self.key[0]},{self.key[1]},{notifications}"
+
+    def cancel(self) -> None:
+        """Unsubscribe in the background, like cancelling a subscription task."""
+        self.manager.cancel(self)
+
+
+@dataclass(eq=False)
+class SubscriptionGroup:
+    """One SubscribeCOVPropertyMultiple subscription covering several objects of a device."""
+
+    device_identifier: ObjectIdentifier
+    confirmed: bool
+    lifetime: int | None
+    process_identifier: int
+    members: dict[str, Subscription] = field(default_factory=dict, repr=False)
+    status: str = "pending"
+    expires: float | None = None
+    renew_at: float | None = None
+
+    def get_name(self) -> str:
+        return f"device:{self.device_identifier[1]},{len(self.members)} objects,confirmed"
+
+
+class SubscriptionManager:
+    """Keeps track of all CoV subscriptions of the application.
+
+    Renewals are kept in a heap and sent in batches by a single task shortly before the lifetime expires.
+    Notifications are routed to their subscription by subscriber process identifier, no task per subscription.
+    Confirmed subscriptions to devices supporting SubscribeCOVPropertyMultiple are grouped per device,
+    falling back to SubscribeCOV per object when the device refuses.
+    Points whose subscription fails get polled and are subscribed again with exponential backoff.
+    Requests to a device are spread at subscribe_rate per second with some jitter, so creating and
+    renewing thousands of subscriptions doesn't hit the network at once.
+    Devices refusing subscriptions for lack of resources get a capacity, the highest ranked points
+    up to that capacity are subscribed and the rest is polled on standby.
+    Subscriptions still on the devices at shutdown are saved to state_path. The next start takes
+    over their process identifiers when subscribing to the same objects, the rest gets cancelled.
+    """
+
+    def __init__(
+        self,
+        app,
+        subscription_list: list,
+        renew_concurrency: int = 8,
+        renew_batch_window: float = 1.0,
+        group_delay: float = 1.0,
+        retry_min: float = 30,
+        retry_max: float = 1800,
+        subscribe_rate: float = 10,
+        renew_jitter: float = 0.1,
+        context_wait: float = 2.0,
+        rebalance_interval: float = 300,
+        state_path: str = "/data/cov_subscriptions.json",
+        stop_deadline: float = 8,
+        stop_concurrency: int = 32,
+        orphan_grace: float = 300,
+    ) -> None:
+        self.app = app
+        # shared with the web API, which shows it on the subscriptions page
+        self.subscription_list = subscription_list
+        self.subscriptions: dict[tuple[str, str], Subscription] = {}
+        self.by_process_identifier: dict[int, Subscription | SubscriptionGroup] = {}
+        # process identifiers expected to be registered soon, notifications for them wait
+        self.pending_contexts: dict[int, asyncio.Event] = {}
+        self.context_wait = context_wait
+        self.renewals: list = []
+        self.renewal_counter = itertools.count()
+        self.renew_batch_window = renew_batch_window
+        self.renew_semaphore = asyncio.Semaphore(renew_concurrency)
+        self.wakeup = asyncio.Event()
+        self.next_process_identifier = 1
+        self.group_delay = group_delay
+        self.retry_min = retry_min
+        self.retry_max = retry_max
+        self.subscribe_rate = subscribe_rate
+        self.renew_jitter = renew_jitter
+        self.device_slots: dict[int, float] = {}
+        self.to_group: dict[int, list[Subscription]] = {}
+        self.no_property_multiple: set[int] = set()
+        self.capacity: dict[int, int] = {}
+        self.rebalance_interval = rebalance_interval
+        self.rebalancer: asyncio.Task | None = None
+        self.stopping = False
+        self.state_path = state_path
+        self.stop_deadline = stop_deadline
+        self.stop_concurrency = stop_concurrency
+        self.orphan_grace = orphan_grace
+        # subscriptions a previous run left on the devices, by process identifier
+        self.orphans: dict[int, Subscription | SubscriptionGroup] = {}
+        self.orphan_keys: dict[tuple[str, str, bool], int] = {}
+        self.tasks: set[asyncio.Task] = set()
+        self.scheduler: asyncio.Task | None = None
+
+    def start(self) -> None:
+        self.scheduler = asyncio.get_event_loop().create_task(self.renewal_task())
+        self.rebalancer = asyncio.get_event_loop().create_task(self.rebalance_task())
+        self.load_state()
+        if self.orphans:
+            self.create_task(self.orphan_task())
+
+    def create_task(self, coro) -> asyncio.Task:
+        task = asyncio.get_event_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def get(
+        self, device_identifier: ObjectIdentifier, object_identifier: ObjectIdentifier
+    ) -> Subscription | None:
+        return self.subscriptions.get(
+            (
+                f"{device_identifier[0].attr}:{device_identifier[1]}",
+                f"{object_identifier[0].attr}:{object_identifier[1]}",
+            )
+        )
+
+    def assign_process_identifier(self) -> int:
+        while (
+            self.next_process_identifier in self.by_process_identifier
+            or self.next_process_identifier in self.pending_contexts
+            or self.next_process_identifier in self.orphans
+        ):
+            self.next_process_identifier += 1
+        process_identifier = self.next_process_identifier
+        self.next_process_identifier = (self.next_process_identifier % 4194303) + 1
+        return process_identifier
+
+    def index(
+        self, process_identifier: int, item: Subscription | SubscriptionGroup
+    ) -> None:
+        """Route notifications with this process identifier to a subscription or group."""
+        self.by_process_identifier[process_identifier] = item
+
+        event = self.pending_contexts.pop(process_identifier, None)
+        if event:
+            event.set()
+
+    def expect(self, process_identifier: int) -> None:
+        """Hold notifications for a process identifier that gets registered shortly."""
+        if process_identifier not in self.by_process_identifier:
+            self.pending_contexts.setdefault(process_identifier, asyncio.Event())
+
+    def unexpect(self, process_identifier: int) -> None:
+        event = self.pending_contexts.pop(process_identifier, None)
+        if event:
+            # waiting notifications give up and get rejected
+            event.set()
+
+    async def wait_for_context(self, process_identifier: int) -> bool:
+        """Wait at most context_wait seconds for an expected process identifier, False if it's unknown."""
+        event = self.pending_contexts.get(process_identifier)
+
+        if event is None:
+            return False
+
+        try:
+            await asyncio.wait_for(event.wait(), self.context_wait)
+        except asyncio.TimeoutError:
+            LOGGER.debug(f"Process identifier {process_identifier} didn't get registered")
+            self.pending_contexts.pop(process_identifier, None)
+            return False
+
+        return process_identifier in self.by_process_identifier
+
+    def device_properties(self, device_identifier: ObjectIdentifier) -> dict:
+        device_key = f"device:{device_identifier[1]}"
+        return self.app.bacnet_device_dict.get(device_key, {}).get(device_key, {})
+
+    def supports_property_multiple(self, device_identifier: ObjectIdentifier) -> bool:
+        if device_identifier[1] in self.no_property_multiple:
+            return False
+
+        services_supported = self.device_properties(device_identifier).get(
+            "protocolServicesSupported", ServicesSupported()
+        )
+
+        return services_supported["subscribe-cov-property-multiple"] == 1
+
+    def group_size(self, device_identifier: ObjectIdentifier) -> int:
+        """Estimate how many objects fit in one unsegmented SubscribeCOVPropertyMultiple."""
+        max_apdu = int(
+            self.device_properties(device_identifier).get("maxApduLengthAccepted", 480)
+        )
+        # roughly 20 bytes of header, 25 bytes per object with its property references
+        return max(1, (max_apdu - 20) // 25)
+
+    def device_rate(self, device_identifier: ObjectIdentifier) -> float:
+        return float(
+            self.app.get_config_from_addon_config(device_identifier).get(
+                "CoV_subscribe_rate", self.subscribe_rate
+            )
+        )
+
+    def reserve_slot(self, device_identifier: ObjectIdentifier) -> float:
+        """Reserve the next free moment to send a request to a device."""
+        now = time.monotonic()
+        rate = self.device_rate(device_identifier)
+        slot = max(now, self.device_slots.get(device_identifier[1], now))
+        self.device_slots[device_identifier[1]] = slot + 1 / rate
+        return slot + random.uniform(0, 1 / rate)
+
+    async def throttle(self, device_identifier: ObjectIdentifier) -> None:
+        delay = self.reserve_slot(device_identifier) - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def register(self, subscription: Subscription) -> None:
+        """Give a subscription its own process identifier and schedule sending it."""
+        subscription.group = None
+        subscription.process_identifier = (
+            self.adopt(subscription) or self.assign_process_identifier()
+        )
+        self.index(subscription.process_identifier, subscription)
+        self.schedule(subscription, self.reserve_slot(subscription.device_identifier))
+
+    def adopt(self, subscription: Subscription) -> int | None:
+        """Process identifier of the same subscription left by a previous run, subscribing again renews it."""
+        process_identifier = self.orphan_keys.pop(
+            (*subscription.key, subscription.confirmed), None
+        )
+
+        if process_identifier is None:
+            return None
+
+        self.orphans.pop(process_identifier, None)
+
+        LOGGER.debug(
+            f"Taking over process identifier {process_identifier} for {subscription.get_name()}"
+        )
+
+        return process_identifier
+
+    def subscribe(
+        self,
+        device_identifier: ObjectIdentifier,
+        object_identifier: ObjectIdentifier,
+        confirmed: bool = True,
+        lifetime: int | None = None,
+    ) -> Subscription:
+        """Register a subscription and send the subscribe request in the background."""
+        existing = self.get(device_identifier, object_identifier)
+
+        if existing:
+            return existing
+
+        full = self.at_capacity(device_identifier[1])
+
+        subscription = Subscription(
+            manager=self,
+            device_identifier=device_identifier,
+            object_identifier=object_identifier,
+            confirmed=confirmed,
+            lifetime=lifetime,
+            **self.filter_config(device_identifier, object_identifier),
+        )
+
+        self.subscriptions[subscription.key] = subscription
+        self.subscription_list.append(subscription)
+
+        if full:
+            LOGGER.debug(
+                f"device:{device_identifier[1]} is at its capacity, polling {subscription.key[1]}"
+            )
+            self.standby(subscription)
+            return subscription
+
+        LOGGER.debug(f"Creating {subscription.get_name()} subscription")
+
+        if confirmed and self.supports_property_multiple(device_identifier):
+            # collect the subscriptions made shortly after each other into groups
+            device_id = device_identifier[1]
+            if device_id not in self.to_group:
+                self.to_group[device_id] = []
+                self.create_task(self.form_groups(device_identifier))
+            self.to_group[device_id].append(subscription)
+        else:
+            # registered before sending, notifications can arrive before the acknowledgement
+            self.register(subscription)
+
+        return subscription
+
+    async def form_groups(self, device_identifier: ObjectIdentifier) -> None:
+        """Send the collected subscriptions of a device as SubscribeCOVPropertyMultiple groups."""
+        await asyncio.sleep(self.group_delay)
+
+        subscriptions = [
+            subscription
+            for subscription in self.to_group.pop(device_identifier[1], [])
+            if subscription.status == "pending"
+        ]
+
+        size = self.group_size(device_identifier)
+
+        for start in range(0, len(subscriptions), size):
+            members = subscriptions[start : start + size]
+
+            group = SubscriptionGroup(
+                device_identifier=device_identifier,
+                confirmed=True,
+                lifetime=members[0].lifetime,
+                process_identifier=self.assign_process_identifier(),
+            )
+
+            for subscription in members:
+                subscription.group = group
+                subscription.process_identifier = group.process_identifier
+                group.members[subscription.key[1]] = subscription
+
+            self.index(group.process_identifier, group)
+
+            LOGGER.debug(f"Creating {group.get_name()} subscription")
+
+            self.schedule(group, self.reserve_slot(device_identifier))
+
+    def subscribe_request(self, item: Subscription | SubscriptionGroup, address):
+        if isinstance(item, SubscriptionGroup):
+            request = SubscribeCOVPropertyMultipleRequest(
+                subscriberProcessIdentifier=item.process_identifier,
+                issueConfirmedNotifications=item.confirmed,
+                listOfCOVSubscriptionSpecifications=self.specifications(
+                    list(item.members.values())
+                ),
+                destination=address,
+            )
+        else:
+            request = SubscribeCOVRequest(
+                subscriberProcessIdentifier=item.process_identifier,
+                monitoredObjectIdentifier=item.object_identifier,
+                issueConfirmedNotifications=item.confirmed,
+                destination=address,
+            )
+
+        if item.lifetime:
+            request.lifetime = item.lifetime
+
+        return request
+
+    def specifications(
+        self, subscriptions: list[Subscription]
+    ) -> list[COVSubscriptionSpecification]:
+        return [
+            COVSubscriptionSpecification(
+                monitoredObjectIdentifier=subscription.object_identifier,
+                listOfCOVReferences=[
+                    COVReference(
+                        monitoredProperty=property_identifier,
+                        timestamped=False,
+                    )
+                    for property_identifier in cov_properties
+                ],
+            )
+            for subscription in subscriptions
+        ]
+
+    def set_status(self, item: Subscription | SubscriptionGroup, status: str) -> None:
+        item.status = status
+        if isinstance(item, SubscriptionGroup):
+            for subscription in item.members.values():
+                subscription.status = status
+
+    async def send(self, item: Subscription | SubscriptionGroup) -> bool:
+        """Send a subscribe request for a new subscription or a renewal."""
+        address = self.app.dev_to_addr(item.device_identifier)
+
+        try:
+            if address is None:
+                raise ValueError(f"unknown device {item.device_identifier}")
+
+            await self.app.request(self.subscribe_request(item, address))
+
+        except (ErrorRejectAbortNack, Exception) as err:
+            if item.status == "cancelled":
+                return False
+
+            now = time.monotonic()
+            retry = max(5, (item.lifetime or 0) // 10)
+
+            if item.status == "active" and item.expires and now + retry < item.expires:
+                LOGGER.warning(
+                    f"Renewing {item.get_name()} failed, retrying in {retry}s: {err}"
+                )
+                self.schedule(item, now + retry)
+                return False
+
+            if item.status in ("pending", "failed") and self.is_capacity_error(err):
+                LOGGER.warning(
+                    f"device:{item.device_identifier[1]} refused {item.get_name()} for lack of resources: {err}"
+                )
+                if isinstance(item, SubscriptionGroup):
+                    item.status = "cancelled"
+                    self.by_process_identifier.pop(item.process_identifier, None)
+                for subscription in self.members(item):
+                    self.standby(subscription)
+                self.learn_capacity(item.device_identifier[1])
+                return False
+
+            if item.status == "failed":
+                LOGGER.debug(f"Subscription {item.get_name()} still failing: {err}")
+                self.degrade(item)
+                return False
+
+            if isinstance(item, SubscriptionGroup) and item.status == "pending":
+                LOGGER.warning(
+                    f"SubscribeCOVPropertyMultiple to {item.device_identifier} failed, subscribing per object: {err}"
+                )
+                self.no_property_multiple.add(item.device_identifier[1])
+                self.split(item)
+                return False
+
+            LOGGER.error(f"Subscription {item.get_name()} failed: {err}")
+            self.fail(item)
+            return False
+
+        if item.status in ("cancelled", "standby"):
+            return False
+
+        if item.status == "pending":
+            LOGGER.debug(f"Created {item.get_name()} subscription successfully")
+            # points promoted from standby were polled until now
+            for subscription in self.members(item):
+                self.app.stop_fallback_poll(
+                    subscription.device_identifier, subscription.object_identifier
+                )
+        elif item.status == "failed":
+            LOGGER.info(f"Subscription {item.get_name()} recovered, polling stops")
+            self.app.stop_fallback_poll(item.device_identifier, item.object_identifier)
+            item.retry_delay = 0
+
+        self.set_status(item, "active")
+
+        for subscription in self.members(item):
+            subscription.settled.set()
+
+        device_id = item.device_identifier[1]
+        if device_id in self.capacity:
+            # the device took more than it refused before, room freed up
+            self.capacity[device_id] = max(
+                self.capacity[device_id], self.in_use(device_id, ("active",))
+            )
+
+        now = time.monotonic()
+
+        # subscription got acknowledged, polls can rest until CoV goes quiet
+        for subscription in self.members(item):
+            self.app.cov_health[subscription.key] = now
+
+        if item.lifetime:
+            item.expires = now + item.lifetime
+            # jitter keeps subscriptions made at the same time from renewing together
+            self.schedule(
+                item,
+                item.expires
+                - max(5, item.lifetime // 5)
+                - random.uniform(0, item.lifetime * self.renew_jitter),
+            )
+
+        return True
+
+    def members(self, item: Subscription | SubscriptionGroup) -> list[Subscription]:
+        if isinstance(item, SubscriptionGroup):
+            return list(item.members.values())
+        return [item]
+
+    def split(self, group: SubscriptionGroup) -> None:
+        """Subscribe to the objects of a refused group one by one."""
+        group.status = "cancelled"
+        self.by_process_identifier.pop(group.process_identifier, None)
+
+        for subscription in group.members.values():
+            self.register(subscription)
+
+    def schedule(self, item: Subscription | SubscriptionGroup, renew_at: float) -> None:
+        """Put a subscribe request in the heap, waking the scheduler if it's the first one due."""
+        item.renew_at = renew_at
+        heapq.heappush(self.renewals, (renew_at, next(self.renewal_counter), item))
+        if self.renewals[0][2] is item:
+            self.wakeup.set()
+
+    async def renewal_task(self) -> None:
+        """Send the subscribe requests that are due, in batches."""
+        try:
+            while True:
+                if not self.renewals:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+
+                delay = self.renewals[0][0] - time.monotonic()
+
+                if delay > 0:
+                    self.wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                due: list = []
+                horizon = time.monotonic() + self.renew_batch_window
+
+                while self.renewals and self.renewals[0][0] <= horizon:
+                    renew_at, _, item = heapq.heappop(self.renewals)
+
+                    # stale entries of rescheduled or cancelled subscriptions
+                    if item.renew_at != renew_at or item.status not in (
+                        "pending",
+                        "active",
+                        "failed",
+                    ):
+                        continue
+
+                    due.append(item)
+
+                if due:
+                    LOGGER.debug(f"Sending {len(due)} subscribe requests")
+                    for item in due:
+                        self.create_task(self.renew(item))
+
+        except asyncio.CancelledError as err:
+            LOGGER.debug(f"Subscription renewal task cancelled: {err}")
+
+    async def renew(self, item: Subscription | SubscriptionGroup) -> None:
+        if item.status != "pending":
+            # new subscriptions got their slot when scheduled, renewals and retries get one now
+            await self.throttle(item.device_identifier)
+        async with self.renew_semaphore:
+            await self.send(item)
+
+    def forget(self, subscription: Subscription) -> None:
+        """Drop a subscription from all indexes, polling takes over again."""
+        was_active = subscription.status == "active"
+
+        if subscription.status in ("failed", "standby"):
+            self.app.stop_fallback_poll(
+                subscription.device_identifier, subscription.object_identifier
+            )
+
+        subscription.status = "cancelled"
+        subscription.settled.set()
+        if subscription.flush_handle:
+            subscription.flush_handle.cancel()
+            subscription.flush_handle = None
+        self.subscriptions.pop(subscription.key, None)
+        if subscription in self.subscription_list:
+            self.subscription_list.remove(subscription)
+        self.app.cov_health.pop(subscription.key, None)
+
+        self.leave_group(subscription)
+
+        # the freed up place goes to the best point on standby
+        if was_active and not self.stopping:
+            self.fill(subscription.device_identifier[1])
+
+    def leave_group(self, subscription: Subscription) -> None:
+        """Stop routing notifications to a subscription, cancelling its group when it was the last member."""
+        group = subscription.group
+        subscription.group = None
+
+        if group is None:
+            if subscription.process_identifier is not None:
+                self.by_process_identifier.pop(subscription.process_identifier, None)
+            return
+
+        group.members.pop(subscription.key[1], None)
+
+        if not group.members:
+            group.status = "cancelled"
+            self.by_process_identifier.pop(group.process_identifier, None)
+
+    def fail(self, item: Subscription | SubscriptionGroup) -> None:
+        if isinstance(item, SubscriptionGroup):
+            item.status = "cancelled"
+            self.by_process_identifier.pop(item.process_identifier, None)
+
+        for subscription in self.members(item):
+            self.degrade(subscription)
+
+    def degrade(self, subscription: Subscription) -> None:
+        """Poll a point whose subscription failed, and try subscribing again after a growing delay."""
+        if subscription.group or subscription.process_identifier is None:
+            if subscription.group:
+                subscription.group.members.pop(subscription.key[1], None)
+            subscription.group = None
+            subscription.process_identifier = self.assign_process_identifier()
+            self.index(subscription.process_identifier, subscription)
+
+        if subscription.status != "failed":
+            self.app.start_fallback_poll(
+                subscription.device_identifier, subscription.object_identifier
+            )
+
+        subscription.status = "failed"
+        subscription.expires = None
+        subscription.settled.set()
+        self.app.cov_health.pop(subscription.key, None)
+
+        subscription.retry_delay = min(
+            self.retry_max, max(self.retry_min, subscription.retry_delay * 2)
+        )
+
+        LOGGER.info(
+            f"Polling {subscription.key[1]} of {subscription.key[0]}, subscribing again in {subscription.retry_delay}s"
+        )
+
+        self.schedule(subscription, time.monotonic() + subscription.retry_delay)
+
+    def cancel(self, subscription: Subscription) -> None:
+        if subscription.status == "cancelled":
+            return
+        self.create_task(self.unsubscribe(subscription))
+
+    def cancel_request(
+        self, item: Subscription | SubscriptionGroup, subscriptions: list[Subscription], address
+    ):
+        """A request without lifetime and confirmation type cancels the subscription."""
+        if isinstance(item, SubscriptionGroup):
+            return SubscribeCOVPropertyMultipleRequest(
+                subscriberProcessIdentifier=item.process_identifier,
+                listOfCOVSubscriptionSpecifications=self.specifications(subscriptions),
+                destination=address,
+            )
+
+        return SubscribeCOVRequest(
+            subscriberProcessIdentifier=item.process_identifier,
+            monitoredObjectIdentifier=item.object_identifier,
+            destination=address,
+        )
+
+    async def unsubscribe(self, subscription: Subscription) -> None:
+        """Forget a subscription and cancel it on the device."""
+        item = subscription.group or subscription
+        was_active = subscription.status == "active"
+
+        LOGGER.info(
+            f"Cancelling subscription: {subscription.device_identifier}, {subscription.object_identifier}"
+        )
+
+        self.forget(subscription)
+
+        if was_active:
+            await self.send_cancel(item, [subscription])
+
+    async def send_cancel(
+        self, item: Subscription | SubscriptionGroup, subscriptions: list[Subscription]
+    ) -> bool:
+        address = self.app.dev_to_addr(item.device_identifier)
+
+        if address is None:
+            return False
+
+        try:
+            await self.app.request(self.cancel_request(item, subscriptions, address))
+        except (ErrorRejectAbortNack, Exception) as err:
+            LOGGER.warning(f"Failed to cancel {item.get_name()}: {err}")
+            return False
+
+        return True
+
+    async def stop(self, deadline: float | None = None) -> None:
+        """Stop renewing and cancel all subscriptions in parallel, a group in one request.
+
+        Cancel requests are rate limited per device and given up on after deadline seconds.
+        Subscriptions that didn't get cancelled are saved for the next start to clean up.
+        """
+        self.stopping = True
+
+        if self.scheduler:
+            self.scheduler.cancel()
+
+        if self.rebalancer:
+            self.rebalancer.cancel()
+
+        for process_identifier in list(self.pending_contexts):
+            self.unexpect(process_identifier)
+
+        cancels: dict = {}
+
+        for subscription in list(self.subscriptions.values()):
+            item = subscription.group or subscription
+            if subscription.status == "active":
+                cancels.setdefault(item, []).append(subscription)
+            self.forget(subscription)
+
+        for item in self.orphans.values():
+            cancels[item] = self.members(item)
+
+        # saved before cancelling, the add-on gets killed when stopping takes too long
+        self.save_state(cancels)
+
+        if not cancels:
+            return
+
+        remaining = dict(cancels)
+        semaphore = asyncio.Semaphore(self.stop_concurrency)
+        self.device_slots.clear()
+
+        async def cancel(item, subscriptions) -> None:
+            await self.throttle(item.device_identifier)
+            async with semaphore:
+                if await self.send_cancel(item, subscriptions):
+                    remaining.pop(item, None)
+
+        pending = {
+            asyncio.create_task(cancel(item, subscriptions))
+            for item, subscriptions in cancels.items()
+        }
+
+        end = time.monotonic() + (self.stop_deadline if deadline is None else deadline)
+
+        while pending and time.monotonic() < end:
+            _, pending = await asyncio.wait(
+                pending, timeout=min(1, end - time.monotonic())
+            )
+            LOGGER.info(
+                f"Cancelled {len(cancels) - len(remaining)} of {len(cancels)} subscriptions"
+            )
+
+        for task in pending:
+            task.cancel()
+
+        self.save_state(remaining)
+
+        if remaining:
+            LOGGER.warning(
+                f"{len(remaining)} subscriptions not cancelled, they get cleaned up on the next start"
+            )
+        else:
+            LOGGER.info("Cancelled all subscriptions")
+
+    def save_state(self, items: dict) -> None:
+        """Save the subscriptions still on the devices, with their expiry as a timestamp."""
+        now = time.monotonic()
+
+        state = [
+            {
+                "device": f"device:{item.device_identifier[1]}",
+                "objects": [subscription.key[1] for subscription in subscriptions],
+                "process_identifier": item.process_identifier,
+                "confirmed": item.confirmed,
+                "group": isinstance(item, SubscriptionGroup),
+                "expires": None
+                if item.expires is None
+                else time.time() + item.expires - now,
+            }
+            for item, subscriptions in items.items()
+        ]
+
+        try:
+            temp_path = f"{self.state_path}.tmp"
+
+            with open(temp_path, "w") as state_file:
+                json.dump(state, state_file)
+
+            os.replace(temp_path, self.state_path)
+
+        except Exception as err:
+            LOGGER.warning(f"Failed to save subscriptions {self.state_path}: {err}")
+
+    def load_state(self) -> None:
+        """Restore the subscriptions a previous run left on the devices as orphans."""
+        try:
+            with open(self.state_path, "r") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return
+        except Exception as err:
+            LOGGER.warning(f"Failed to load subscriptions {self.state_path}: {err}")
+            return
+
+        now = time.time()
+
+        for entry in state:
+            if entry["expires"] is not None and entry["expires"] < now:
+                continue
+
+            try:
+                device_identifier = ObjectIdentifier(entry["device"])
+                members = [
+                    Subscription(
+                        manager=self,
+                        device_identifier=device_identifier,
+                        object_identifier=ObjectIdentifier(object_key),
+                        confirmed=entry["confirmed"],
+                        lifetime=None,
+                        process_identifier=entry["process_identifier"],
+                        status="orphan",
+                    )
+                    for object_key in entry["objects"]
+                ]
+            except Exception as err:
+                LOGGER.warning(f"Ignoring saved subscription {entry}: {err}")
+                continue
+
+            if entry["group"]:
+                item = SubscriptionGroup(
+                    device_identifier=device_identifier,
+                    confirmed=entry["confirmed"],
+                    lifetime=None,
+                    process_identifier=entry["process_identifier"],
+                    members={member.key[1]: member for member in members},
+                    status="orphan",
+                )
+            elif members:
+                item = members[0]
+                self.orphan_keys[(*item.key, item.confirmed)] = item.process_identifier
+                # notifications of the previous run wait for the subscription to be taken over
+                self.expect(item.process_identifier)
+            else:
+                continue
+
+            if entry["expires"] is not None:
+                item.expires = time.monotonic() + entry["expires"] - now
+
+            self.orphans[item.process_identifier] = item
+
+        if self.orphans:
+            LOGGER.info(
+                f"{len(self.orphans)} subscriptions of the previous run are still on the devices"
+            )
+
+    async def orphan_task(self) -> None:
+        """Cancel the subscriptions of the previous run that didn't get taken over."""
+        try:
+            await asyncio.sleep(self.orphan_grace)
+
+            orphans, self.orphans = self.orphans, {}
+            self.orphan_keys.clear()
+
+            for process_identifier in orphans:
+                self.unexpect(process_identifier)
+
+            async def cancel(item) -> None:
+                await self.throttle(item.device_identifier)
+                async with self.renew_semaphore:
+                    await self.send_cancel(item, self.members(item))
+
+            await asyncio.gather(*(cancel(item) for item in orphans.values()))
+
+            LOGGER.info(f"Cancelled {len(orphans)} subscriptions of the previous run")
+
+        except asyncio.CancelledError as err:
+            LOGGER.debug(f"Orphaned subscription task cancelled: {err}")
+
+    def route(self, apdu) -> Subscription | SubscriptionGroup | None:
+        """Find the subscription or group of a notification by process identifier and device."""
+        item = self.by_process_identifier.get(apdu.subscriberProcessIdentifier)
+
+        if (
+            item is None
+            or apdu.initiatingDeviceIdentifier[1] != item.device_identifier[1]
+        ):
+            return None
+
+        return item
+
+    def member(
+        self, item: Subscription | SubscriptionGroup, object_identifier: ObjectIdentifier
+    ) -> Subscription | None:
+        if isinstance(item, SubscriptionGroup):
+            return item.members.get(
+                f"{object_identifier[0].attr}:{object_identifier[1]}"
+            )
+        if object_identifier == item.object_identifier:
+            return item
+        return None
+
+    async def handle_notification(self, apdu) -> bool:
+        """Store the values of a CoV notification, False if it isn't for one of our subscriptions.
+
+        Notifications for an expected process identifier wait until it's registered, others are refused right away.
+        """
+        item = self.route(apdu)
+
+        if item is None and await self.wait_for_context(
+            apdu.subscriberProcessIdentifier
+        ):
+            item = self.route(apdu)
+
+        if item is None:
+            return False
+
+        self.app.device_seen(item.device_identifier[1])
+
+        subscription = self.member(item, apdu.monitoredObjectIdentifier)
+
+        if subscription is None:
+            return False
+
+        self.store_values(subscription, apdu.listOfValues)
+
+        return True
+
+    async def handle_notification_multiple(self, apdu) -> bool:
+        """Store the values of a CoV notification covering several objects."""
+        group = self.route(apdu)
+
+        if group is None and await self.wait_for_context(
+            apdu.subscriberProcessIdentifier
+        ):
+            group = self.route(apdu)
+
+        if not isinstance(group, SubscriptionGroup):
+            return False
+
+        self.app.device_seen(group.device_identifier[1])
+
+        for notification in apdu.listOfCOVNotifications:
+            subscription = self.member(group, notification.monitoredObjectIdentifier)
+
+            if subscription is None:
+                LOGGER.debug(
+                    f"Notification for {notification.monitoredObjectIdentifier} not in {group.get_name()}"
+                )
+                continue
+
+            self.store_values(subscription, notification.listOfValues)
+
+        return True
+
+    def filter_config(
+        self, device_identifier: ObjectIdentifier, object_identifier: ObjectIdentifier
+    ) -> dict:
+        """Deadband and minimum interval of a point, an entry in CoV_filters overrides the device settings."""
+        config = self.app.get_config_from_addon_config(device_identifier)
+
+        device_key = f"device:{device_identifier[1]}"
+        object_key = f"{object_identifier[0].attr}:{object_identifier[1]}"
+
+        point = next(
+            (
+                entry
+                for entry in self.app.cov_filters
+                if entry.get("deviceID") == device_key
+                and entry.get("objectID") == object_key
+            ),
+            {},
+        )
+
+        return {
+            "deadband": float(point.get("deadband", config.get("CoV_deadband", 0))),
+            "min_interval": float(
+                point.get("min_interval", config.get("CoV_min_interval", 0))
+            ),
+        }
+
+    def store_values(self, subscription: Subscription, list_of_values) -> None:
+        """Cast the notified values to their datatype and pass them through the filter to the device dict."""
+        object_class = self.app.vendor_info.get_object_class(
+            subscription.object_identifier[0]
+        )
+
+        notifications = "confirmed" if subscription.confirmed else "unconfirmed"
+
+        values: dict = {}
+
+        for property_value in list_of_values:
+            property_identifier = property_value.propertyIdentifier
+
+            property_type = (
+                object_class.get_property_type(property_identifier)
+                if object_class
+                else None
+            )
+
+            if property_type is None or property_value.value is None:
+                LOGGER.warning(
+                    f"NoneType property: {subscription.object_identifier} {property_identifier} {property_value.value}"
+                )
+                continue
+            elif property_identifier not in object_properties_to_read_once:
+                LOGGER.warning(
+                    f"Ignoring property: {subscription.object_identifier[0]} {property_identifier}"
+                )
+                continue
+
+            values[property_identifier] = property_value.value.cast_out(property_type)
+
+        LOGGER.debug(
+            f"{notifications} CoV: {subscription.device_identifier} {subscription.object_identifier} {values}"
+        )
+
+        subscription.notifications += 1
+        subscription.last_notification = time.monotonic()
+        self.app.cov_health[subscription.key] = subscription.last_notification
+
+        self.filter(subscription, values)
+
+    def filter(self, subscription: Subscription, values: dict) -> None:
+        """Drop changes within the deadband and hold back notifications arriving within the minimum interval.
+
+        Held values are replaced by newer ones and the latest get delivered once the interval has passed.
+        Status flag changes are never held back. Values equal to the stored ones are dropped,
+        so a notification that changes nothing isn't stored or broadcast.
+        """
+        if subscription.deadband or subscription.min_interval:
+            for property_identifier, value in list(values.items()):
+                if property_identifier not in subscription.delivered:
+                    continue
+
+                last = subscription.delivered[property_identifier]
+
+                if value == last or (
+                    isinstance(value, float)
+                    and isinstance(last, float)
+                    and abs(value - last) < subscription.deadband
+                ):
+                    del values[property_identifier]
+                    # back to the stored value, a held change is outdated
+                    subscription.held.pop(property_identifier, None)
+
+        if not values:
+            subscription.filtered += 1
+            return
+
+        if subscription.min_interval and subscription.delivered_at is not None:
+            flush_at = subscription.delivered_at + subscription.min_interval
+            status_flags = values.get(PropertyIdentifier("statusFlags"))
+
+            if time.monotonic() < flush_at and (
+                status_flags is None
+                or status_flags
+                == subscription.delivered.get(PropertyIdentifier("statusFlags"))
+            ):
+                subscription.held.update(values)
+                subscription.filtered += 1
+
+                if subscription.flush_handle is None:
+                    loop = asyncio.get_event_loop()
+                    subscription.flush_handle = loop.call_later(
+                        flush_at - time.monotonic(), self.flush, subscription
+                    )
+                return
+
+        subscription.held.update(values)
+        self.flush(subscription)
+
+    def flush(self, subscription: Subscription) -> None:
+        """Put the held values of a subscription in the device dict."""
+        if subscription.flush_handle:
+            subscription.flush_handle.cancel()
+            subscription.flush_handle = None
+
+        if subscription.status == "cancelled" or not subscription.held:
+            return
+
+        values, subscription.held = subscription.held, {}
+
+        for property_identifier, value in values.items():
+            self.app.dict_updater(
+                device_identifier=subscription.device_identifier,
+                object_identifier=subscription.object_identifier,
+                property_identifier=property_identifier,
+                property_value=value,
+                source="cov",
+            )
+
+        subscription.delivered.update(values)
+        subscription.delivered_at = time.monotonic()
+
+    def device_moved(self, device_id: int) -> None:
+        """Renew the subscriptions of a device at its new address right away, failed ones get retried."""
+        items: dict = {}
+
+        for subscription in self.device_subscriptions(device_id):
+            if subscription.status in ("active", "failed"):
+                item = subscription.group or subscription
+                items[id(item)] = item
+
+        for item in items.values():
+            if item.status == "failed":
+                item.retry_delay = 0
+            self.schedule(item, self.reserve_slot(item.device_identifier))
+
+        if items:
+            LOGGER.info(
+                f"Renewing {len(items)} subscriptions of moved device:{device_id}"
+            )
+
+    def forget_device(self, device_id: int) -> None:
+        """Drop what was learned about a device that vanished, its subscriptions get cancelled separately."""
+        self.device_slots.pop(device_id, None)
+        self.no_property_multiple.discard(device_id)
+        self.capacity.pop(device_id, None)
+
+    def is_capacity_error(self, err) -> bool:
+        details = describe_error(err)
+        return (
+            details.get("error_class") == "resources"
+            or details.get("error_code") in capacity_error_codes
+        )
+
+    def device_subscriptions(self, device_id: int) -> list[Subscription]:
+        return [
+            subscription
+            for subscription in self.subscriptions.values()
+            if subscription.device_identifier[1] == device_id
+        ]
+
+    def in_use(self, device_id: int, statuses=("pending", "active")) -> int:
+        """Amount of subscriptions of a device taking up a place, or about to."""
+        return sum(
+            1
+            for subscription in self.device_subscriptions(device_id)
+            if subscription.status in statuses
+        )
+
+    def at_capacity(self, device_id: int) -> bool:
+        capacity = self.capacity.get(device_id)
+        return capacity is not None and self.in_use(device_id) >= capacity
+
+    def learn_capacity(self, device_id: int) -> None:
+        """Remember how many subscriptions a device holds after it refused one."""
+        capacity = self.in_use(device_id, ("active",))
+
+        if self.capacity.get(device_id) != capacity:
+            LOGGER.warning(
+                f"device:{device_id} holds no more than {capacity} CoV subscriptions, polling the rest"
+            )
+
+        self.capacity[device_id] = capacity
+        self.rebalance(device_id)
+
+    def rank(self, subscription: Subscription) -> tuple[bool, float]:
+        """Points in CoV_priority_list first, then the points changing most often."""
+        config = self.app.get_config_from_addon_config(subscription.device_identifier)
+        important = subscription.key[1] in config.get("CoV_priority_list", [])
+
+        hours = max(time.monotonic() - subscription.created, 60) / 3600
+        rate = subscription.notifications / hours
+
+        # subscribed points only get replaced by clearly busier ones
+        if subscription.status == "active":
+            rate *= 2
+
+        return (important, rate)
+
+    def standby(self, subscription: Subscription) -> None:
+        """Poll a point that doesn't fit in the subscription capacity of its device."""
+        if subscription.status not in ("failed", "standby"):
+            self.app.start_fallback_poll(
+                subscription.device_identifier, subscription.object_identifier
+            )
+
+        self.leave_group(subscription)
+        subscription.process_identifier = None
+        subscription.status = "standby"
+        subscription.expires = None
+        subscription.renew_at = None
+        subscription.settled.set()
+        self.app.cov_health.pop(subscription.key, None)
+
+    def promote(self, subscription: Subscription) -> None:
+        LOGGER.debug(f"Subscribing to {subscription.key[1]} of {subscription.key[0]} from standby")
+        subscription.status = "pending"
+        subscription.settled.clear()
+        self.register(subscription)
+
+    def demote(self, subscription: Subscription) -> None:
+        LOGGER.debug(f"Polling {subscription.key[1]} of {subscription.key[0]} instead of subscribing")
+        item = subscription.group or subscription
+
+        if subscription.status == "active":
+            self.create_task(self.send_cancel(item, [subscription]))
+
+        self.standby(subscription)
+
+    def fill(self, device_id: int) -> None:
+        """Subscribe to the best points on standby while the device has room."""
+        if device_id not in self.capacity:
+            return
+
+        standby = sorted(
+            (
+                subscription
+                for subscription in self.device_subscriptions(device_id)
+                if subscription.status == "standby"
+            ),
+            key=self.rank,
+            reverse=True,
+        )
+
+        for subscription in standby:
+            if self.at_capacity(device_id):
+                break
+            self.promote(subscription)
+
+    def rebalance(self, device_id: int) -> None:
+        """Subscribe to the best ranked points up to the capacity of the device and poll the rest."""
+        capacity = self.capacity.get(device_id)
+
+        if capacity is None:
+            return
+
+        ranked = sorted(
+            (
+                subscription
+                for subscription in self.device_subscriptions(device_id)
+                if subscription.status in ("pending", "active", "standby")
+            ),
+            key=self.rank,
+            reverse=True,
+        )
+
+        # free the places first
+        for subscription in ranked[capacity:]:
+            if subscription.status != "standby":
+                self.demote(subscription)
+
+        for subscription in ranked[:capacity]:
+            if subscription.status == "standby":
+                self.promote(subscription)
+
+    async def rebalance_task(self) -> None:
+        """Rerank the points of devices with a known capacity and probe whether room freed up."""
+        try:
+            while True:
+                await asyncio.sleep(self.rebalance_interval)
+
+                for device_id in list(self.capacity):
+                    self.rebalance(device_id)
+
+                    standby = [
+                        subscription
+                        for subscription in self.device_subscriptions(device_id)
+                        if subscription.status == "standby"
+                    ]
+
+                    # one extra subscription tells whether the device has room again
+                    if standby:
+                        self.promote(max(standby, key=self.rank))
+
+        except asyncio.CancelledError as err:
+            LOGGER.debug(f"Subscription rebalance task cancelled: {err}")
+
+    def delivery_mode(self, subscription: Subscription) -> str:
+        """"cov" when subscribed, "cov-pending" while subscribing and "poll-fallback" after the subscription failed."""
+        if subscription.status == "active":
+            return "cov"
+        if subscription.status in ("failed", "standby"):
+            return "poll-fallback"
+        return "cov-pending"
+
+    def schedule_status(self) -> dict:
+        """Per device, how many subscribe requests are planned and when, in seconds from now."""
+        now = time.monotonic()
+        devices: dict = {}
+        kinds = {"pending": "subscribing", "active": "renewing", "failed": "retrying"}
+
+        for renew_at, _, item in self.renewals:
+            if item.renew_at != renew_at or item.status not in (
+                "pending",
+                "active",
+                "failed",
+            ):
+                continue
+
+            device = devices.setdefault(
+                f"device:{item.device_identifier[1]}",
+                {
+                    "rate": self.device_rate(item.device_identifier),
+                    "subscribing": 0,
+                    "renewing": 0,
+                    "retrying": 0,
+                    "due_next_minute": 0,
+                    "next_request_in": None,
+                },
+            )
+
+            device[kinds[item.status]] += 1
+
+            wait = round(max(0, renew_at - now), 1)
+            if wait <= 60:
+                device["due_next_minute"] += 1
+            if device["next_request_in"] is None or wait < device["next_request_in"]:
+                device["next_request_in"] = wait
+
+        for device_id, capacity in self.capacity.items():
+            device = devices.setdefault(f"device:{device_id}", {})
+            device["capacity"] = capacity
+            device["standby"] = self.in_use(device_id, ("standby",))
+
+        return devices
+
+    def status(self) -> list[dict]:
+        """State, lifetime and timing of every subscription, times in seconds from now."""
+        now = time.monotonic()
+
+        def seconds(timestamp: float | None) -> float | None:
+            return None if timestamp is None else round(timestamp - now, 1)
+
+        return [
+            {
+                "device": subscription.key[0],
+                "object": subscription.key[1],
+                "confirmed": subscription.confirmed,
+                "lifetime": subscription.lifetime,
+                "service": "SubscribeCOVPropertyMultiple"
+                if subscription.group
+                else "SubscribeCOV",
+                "process_identifier": subscription.process_identifier,
+                "status": subscription.status,
+                "delivery": self.delivery_mode(subscription),
+                "expires_in": seconds((subscription.group or subscription).expires),
+                "next_request_in": seconds(
+                    (subscription.group or subscription).renew_at
+                ),
+                "last_notification": seconds(subscription.last_notification),
+                "notifications": subscription.notifications,
+                "filtered": subscription.filtered,
+            }
+            for subscription in self.subscriptions.values()
+        ]
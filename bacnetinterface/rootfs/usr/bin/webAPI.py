@@ -6,14 +6,16 @@ import csv
 import json
 import os
 import shutil
+import time
 from contextlib import asynccontextmanager
 from dataclasses import dataclass
 from random import choice, randint
 from typing import Annotated, Any, Callable, Union
 
-from bacpypes3.basetypes import (EngineeringUnits, ObjectIdentifier,
-                                 ObjectType, ObjectTypesSupported,
-                                 PropertyIdentifier)
+from bacpypes3.apdu import ErrorRejectAbortNack
+from bacpypes3.basetypes import (EngineeringUnits, ErrorType,
+                                 ObjectIdentifier, ObjectType,
+                                 ObjectTypesSupported, PropertyIdentifier)
 from bacpypes3.ipv4.app import Application
 from const import LOGGER
 from fastapi import (FastAPI, Path, Query, Request, Response, UploadFile,
@@ -22,7 +24,9 @@ from fastapi.encoders import jsonable_encoder
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import parse_obj_as
+from pydantic import (BaseModel, StrictBool, StrictFloat, StrictInt,
+                      parse_obj_as)
+from writeEngine import WriteRequest, describe_error
 
 # ===================================================
 # Global variables
@@ -32,9 +36,20 @@ bacnet_device_dict: dict
 bacnet_application: Application
 activeSockets: list = []
 EDE_files: list = []
+ede_upload_times: dict = {}
 sub_list: list = []
+metadata_sockets: list = []
+discovery_events: list = []
 
 who_is_func: Callable
+metadata_func: Callable
+discovery_func: Callable
+write_stats_func: Callable
+read_batch_func: Callable
+subscription_status_func: Callable
+delivery_func: Callable
+subscription_schedule_func: Callable
+subscribe_func: Callable
 i_am_func: Callable
 ingress: str
 
@@ -56,6 +71,32 @@ def deep_update(mapping: dict, *updating_mappings: dict) -> dict:
     return updated_mapping
 
 
+def get_metadata(device_key: str | None = None) -> dict:
+    """Return age and source of every property, including EDE placeholders."""
+    metadata = metadata_func(device_key)
+
+    now = time.monotonic()
+
+    for file in EDE_files:
+        for device, objects in file.items():
+            if device_key and device != device_key:
+                continue
+            age = round(now - ede_upload_times.get(device, now), 1)
+            metadata = deep_update(
+                metadata,
+                {
+                    device: {
+                        obj: {
+                            prop: {"age": age, "source": "ede"} for prop in properties
+                        }
+                        for obj, properties in objects.items()
+                    }
+                },
+            )
+
+    return metadata
+
+
 def is_valid_json(data: dict):
     try:
         json.dumps(data)
@@ -65,6 +106,64 @@ def is_valid_json(data: dict):
         return False
 
 
+def is_bool(input_val) -> bool:
+    if isinstance(input_val, bool):
+        return True
+    if isinstance(input_val, str):
+        return input_val.lower() in ("true", "false")
+    return False
+
+
+async def wait_for_writes(requests: list[WriteRequest], timeout: float) -> list[dict]:
+    """Wait for the write engine to finish requests, unfinished ones get the "pending" status."""
+    await asyncio.wait([request.future for request in requests], timeout=timeout)
+
+    results = []
+
+    for request in requests:
+        if not request.future.done():
+            results.append({"status": "pending"})
+            continue
+
+        result = dict(request.future.result())
+        if "value" in result and not isinstance(
+            result["value"], (bool, int, float, str, type(None))
+        ):
+            result["value"] = str(result["value"])
+        results.append(result)
+
+    return results
+
+
+class WriteItem(BaseModel):
+    """A single write of a batch."""
+
+    deviceid: str
+    objectid: str
+    property: str = "presentValue"
+    value: StrictBool | StrictInt | StrictFloat | str | None = None
+    array_index: int | None = None
+    priority: int | None = None
+
+
+class ReadItem(BaseModel):
+    """A single read of a batch."""
+
+    deviceid: str
+    objectid: str
+    property: str = "presentValue"
+    array_index: int | None = None
+
+
+class CovItem(BaseModel):
+    """A single subscription of a batch."""
+
+    deviceid: str
+    objectid: str
+    confirmationType: str = "confirmed"
+    lifetime: int | None = None
+
+
 @dataclass
 class EventStruct:
     """Events and Queue's for BACnetIOHandler"""
@@ -189,7 +288,12 @@ async def ede(request: Request):
 
 
 @app.get("/apiv1/json", tags=["apiv1"])
-async def get_entire_dict():
+async def get_entire_dict(
+    metadata: bool = Query(
+        default=False,
+        description="Return {devices, metadata} with the age and source of each property",
+    )
+):
     """Return all devices and their values."""
     dict_to_send = bacnet_device_dict
     if EDE_files:
@@ -198,6 +302,9 @@ async def get_entire_dict():
 
     data_to_send = jsonable_encoder(dict_to_send)
 
+    if metadata:
+        return {"devices": data_to_send, "metadata": get_metadata()}
+
     return data_to_send
 
 
@@ -332,6 +439,9 @@ async def upload_ede_files(
 
     EDE_files.append(deviceDict)
 
+    for device in deviceDict:
+        ede_upload_times[device] = time.monotonic()
+
     return deviceDict
 
 
@@ -344,6 +454,8 @@ async def delete_ede_file(device_ids: Annotated[list[str] | None, Query()] = Non
         for dictionary in EDE_files
         if all(device not in dictionary for device in device_ids)
     ]
+    for device in device_ids:
+        ede_upload_times.pop(device, None)
     LOGGER.debug(f"EDE Files loaded: {len(EDE_files)}")
     return True
 
@@ -365,6 +477,226 @@ async def download_logs():
         return status.HTTP_404_NOT_FOUND
 
 
+@app.get("/apiv2/discovery", tags=["apiv2"])
+async def read_discovery_status():
+    """Return how many devices are queued, being explored, explored and failed."""
+    return discovery_func()
+
+
+@app.get("/apiv2/discovery/events", tags=["apiv2"])
+async def read_discovery_events():
+    """Return the latest new, moved and vanished device events."""
+    return list(discovery_events)
+
+
+@app.get("/apiv2/cov", tags=["apiv2"])
+async def read_subscriptions():
+    """Return every CoV subscription with its status, lifetime, when it expires and renews and when it last notified."""
+    return subscription_status_func()
+
+
+@app.get("/apiv2/cov/schedule", tags=["apiv2"])
+async def read_subscription_schedule():
+    """Return per device how many subscriptions are being created, renewed and retried, and when the next request goes out."""
+    return subscription_schedule_func()
+
+
+@app.post("/apiv2/cov/batch", tags=["apiv2"])
+async def subscribe_batch(
+    items: list[CovItem],
+    wait: bool = Query(
+        default=False,
+        description="Wait for the devices to confirm or refuse the subscriptions",
+    ),
+    timeout: float = Query(default=10, description="Seconds to wait at most"),
+):
+    """Subscribe to a list of objects and return the status of each subscription, in the same order."""
+    subscriptions: list = []
+    results: list[dict] = []
+
+    for item in items:
+        try:
+            if item.confirmationType.lower() in ("confirmed", "true"):
+                notifications = True
+            elif item.confirmationType.lower() in ("unconfirmed", "false"):
+                notifications = False
+            else:
+                raise ValueError(f"invalid confirmationType {item.confirmationType}")
+
+            device_identifier = ObjectIdentifier(item.deviceid)
+            object_identifier = ObjectIdentifier(item.objectid)
+
+        except Exception as err:
+            LOGGER.warning(f"Invalid subscription in batch {item}: {err}")
+            subscriptions.append(None)
+            results.append({"status": "invalid", "error": str(err)})
+            continue
+
+        subscription = subscribe_func(
+            device_identifier=device_identifier,
+            object_identifier=object_identifier,
+            confirmed=notifications,
+            lifetime=item.lifetime,
+        )
+
+        subscriptions.append(subscription)
+        results.append({"status": subscription.status})
+
+    if wait and any(subscriptions):
+        waiters = [
+            asyncio.create_task(subscription.settled.wait())
+            for subscription in subscriptions
+            if subscription
+        ]
+
+        _, not_settled = await asyncio.wait(waiters, timeout=timeout)
+
+        # don't leave waiters behind for subscriptions that never settle
+        for waiter in not_settled:
+            waiter.cancel()
+
+    for subscription, result in zip(subscriptions, results):
+        if subscription:
+            result["status"] = subscription.status
+            result["delivery"] = subscription.manager.delivery_mode(subscription)
+
+    return results
+
+
+@app.get("/apiv2/delivery", tags=["apiv2"])
+async def read_delivery_modes():
+    """Return whether each object gets its values through CoV, polling, polling after a failed subscription, or not at all."""
+    return delivery_func()
+
+
+@app.get("/apiv2/delivery/{deviceid}", tags=["apiv2"])
+async def read_device_delivery_modes(
+    deviceid: str = Path(description="device:instance"),
+):
+    """Return how each object of a device gets its values."""
+    return delivery_func(deviceid).get(deviceid, {})
+
+
+@app.get("/apiv2/metadata", tags=["apiv2"])
+async def read_metadata():
+    """Return how many seconds ago each property got updated and whether it came from a read, poll, CoV, write or EDE file."""
+    return get_metadata()
+
+
+@app.get("/apiv2/metadata/{deviceid}", tags=["apiv2"])
+async def read_device_metadata(
+    deviceid: str = Path(description="device:instance"),
+):
+    """Return age and source of each property of a device."""
+    return get_metadata(deviceid).get(deviceid, {})
+
+
+@app.get("/apiv2/write/stats", tags=["apiv2"])
+async def read_write_stats():
+    """Return pending writes, write results and acknowledge and end-to-end latency in seconds."""
+    return write_stats_func()
+
+
+@app.post("/apiv2/write/batch", tags=["apiv2"])
+async def write_batch(
+    items: list[WriteItem],
+    timeout: float = Query(
+        default=30, description="Seconds to wait for the writes to finish"
+    ),
+):
+    """Write a list of properties and return the status and latency of each write, in the same order."""
+    requests: list[WriteRequest | None] = []
+    invalid: dict[int, str] = {}
+
+    for index, item in enumerate(items):
+        try:
+            value = parse_obj_as(bool, item.value) if is_bool(item.value) else item.value
+            requests.append(
+                WriteRequest(
+                    device_identifier=ObjectIdentifier(item.deviceid),
+                    object_identifier=ObjectIdentifier(item.objectid),
+                    property_identifier=PropertyIdentifier(item.property),
+                    value=value,
+                    array_index=item.array_index,
+                    priority=item.priority,
+                )
+            )
+        except Exception as err:
+            LOGGER.warning(f"Invalid write in batch {item}: {err}")
+            requests.append(None)
+            invalid[index] = str(err)
+
+    for request in requests:
+        if request:
+            await events.write_queue.put(request)
+
+    valid_requests = [request for request in requests if request]
+
+    results = iter(
+        await wait_for_writes(valid_requests, timeout) if valid_requests else []
+    )
+
+    return [
+        next(results) if request else {"status": "invalid", "error": invalid[index]}
+        for index, request in enumerate(requests)
+    ]
+
+
+@app.post("/apiv2/read/batch", tags=["apiv2"])
+async def read_batch(
+    items: list[ReadItem],
+    max_age: float
+    | None = Query(
+        default=None,
+        description="Serve values updated within this many seconds from cache",
+    ),
+):
+    """Read a list of properties, grouped per device into Read Property Multiple requests, and return each value or error in the same order."""
+    points: list[tuple] = []
+    invalid: dict[int, str] = {}
+
+    for index, item in enumerate(items):
+        try:
+            points.append(
+                (
+                    ObjectIdentifier(item.deviceid),
+                    ObjectIdentifier(item.objectid),
+                    PropertyIdentifier(item.property),
+                    item.array_index,
+                )
+            )
+        except Exception as err:
+            LOGGER.warning(f"Invalid read in batch {item}: {err}")
+            invalid[index] = str(err)
+
+    results = iter(await read_batch_func(points, max_age) if points else [])
+
+    response = []
+
+    for index in range(len(items)):
+        if index in invalid:
+            response.append({"status": "invalid", "error": invalid[index]})
+            continue
+
+        value, source = next(results)
+
+        if isinstance(value, (ErrorRejectAbortNack, Exception, ErrorType)):
+            response.append({"status": "error", **describe_error(value)})
+            continue
+
+        response.append(
+            {
+                "status": "ok",
+                "source": source,
+                "value": value
+                if isinstance(value, (bool, int, float, str, list, dict, type(None)))
+                else str(value),
+            }
+        )
+
+    return response
+
+
 # Any commands or not variable paths should go above here... FastAPI will use it as a variable if you make a new path below this.
 
 
@@ -413,9 +745,14 @@ async def write_property(
     presentValue: Union[int, float, str, None] = None,
     outOfService: Union[bool, None] = None,
     covIncrement: Union[int, float, None] = None,
+    wait: bool = Query(
+        default=False, description="Wait for the writes and return their results"
+    ),
+    timeout: float = Query(default=10, description="Seconds to wait at most"),
 ):
     """Write to a property of an object from a device."""
     property_dict: dict[dict, Any] = {}
+    requests: dict[str, WriteRequest] = {}
     global writeQueue
 
     try:
@@ -430,30 +767,26 @@ async def write_property(
         if covIncrement != None:
             property_dict.update({"covIncrement": covIncrement})
 
-        if property_dict:
-            for key, val in property_dict.items():
-                await events.write_queue.put(
-                    [
-                        ObjectIdentifier(deviceid),
-                        ObjectIdentifier(objectid),
-                        PropertyIdentifier(key),
-                        val,
-                        None,
-                        None,
-                    ]
-                )
-        else:
-            write_req = (
-                ObjectIdentifier(deviceid),
-                ObjectIdentifier(objectid),
-                PropertyIdentifier("presentValue"),
-                None,
-                None,
-                None,
+        if not property_dict:
+            property_dict = {"presentValue": None}
+
+        for key, val in property_dict.items():
+            requests[key] = WriteRequest(
+                device_identifier=ObjectIdentifier(deviceid),
+                object_identifier=ObjectIdentifier(objectid),
+                property_identifier=PropertyIdentifier(key),
+                value=val,
             )
-            await events.write_queue.put(write_req)
+
+        for request in requests.values():
+            await events.write_queue.put(request)
 
         LOGGER.info("Successfully put in Write Queue")
+
+        if wait:
+            results = await wait_for_writes(list(requests.values()), timeout)
+            return dict(zip(requests.keys(), results))
+
         return status.HTTP_200_OK
 
     except Exception as err:
@@ -510,13 +843,26 @@ async def unsubscribe_objectid(deviceid: str, objectid: str):
         return status.HTTP_400_BAD_REQUEST
 
 
+def remove_socket(websocket: WebSocket) -> None:
+    """Stop sending data to a websocket."""
+    activeSockets.remove(websocket)
+    if websocket in metadata_sockets:
+        metadata_sockets.remove(websocket)
+
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
-    """This function will be called whenever a new client connects to the server."""
+async def websocket_endpoint(websocket: WebSocket, metadata: bool = False):
+    """This function will be called whenever a new client connects to the server.
+
+    Connect with ?metadata=true to receive {devices, metadata} messages instead.
+    """
     await websocket.accept()
 
     LOGGER.debug(f"Accepted websocket: {websocket.url}")
 
+    if metadata:
+        metadata_sockets.append(websocket)
+
     # Start a task to write data to the websocket
     write_task = asyncio.create_task(websocket_writer(websocket))
 
@@ -574,17 +920,17 @@ async def websocket_endpoint(websocket: WebSocket):
 
         except (RuntimeError, asyncio.CancelledError) as err:
             write_task.cancel()
-            activeSockets.remove(websocket)
+            remove_socket(websocket)
             LOGGER.error(f"Disconnected with Exception... {err}")
             return
         except WebSocketDisconnect as err:
             write_task.cancel()
-            activeSockets.remove(websocket)
+            remove_socket(websocket)
             LOGGER.info(f"Disconnected websocket: {err}")
             return
         except Exception as err:
             write_task.cancel()
-            activeSockets.remove(websocket)
+            remove_socket(websocket)
             LOGGER.error(f"Disconnected with Exception {err}")
 
 
@@ -595,6 +941,10 @@ async def websocket_writer(websocket: WebSocket):
         data_to_send = jsonable_encoder(bacnet_device_dict)
         if not is_valid_json(data_to_send):
             LOGGER.warning(f"Websocket dict isn't converted to JSON!")
+        elif websocket in metadata_sockets:
+            await websocket.send_json(
+                {"devices": data_to_send, "metadata": get_metadata()}
+            )
         else:
             await websocket.send_json(data_to_send)
         LOGGER.debug("Passed send_json test")
@@ -613,8 +963,16 @@ async def websocket_writer(websocket: WebSocket):
                     LOGGER.warning(f"Websocket dict isn't converted to JSON!")
                     events.val_updated_event.clear()
                     continue
+                if metadata_sockets:
+                    metadata_to_send = {
+                        "devices": data_to_send,
+                        "metadata": get_metadata(),
+                    }
                 for websocket in activeSockets:
-                    await websocket.send_json(data_to_send)
+                    if websocket in metadata_sockets:
+                        await websocket.send_json(metadata_to_send)
+                    else:
+                        await websocket.send_json(data_to_send)
                 events.val_updated_event.clear()
             else:
                 await asyncio.sleep(1)
@@ -641,18 +999,15 @@ async def write_property(
         default=None, description="Array index, usually left empty"
     ),
     priority: int | None = Query(default=None, description="Write priority"),
+    wait: bool = Query(
+        default=False, description="Wait for the write and return its result"
+    ),
+    timeout: float = Query(default=10, description="Seconds to wait at most"),
 ):
     """Write to a property of an object from a device."""
     property_dict: dict[dict, Any] = {}
     dict_to_write: dict[dict, Any] = {}
 
-    def is_bool(input_val) -> bool:
-        if isinstance(input_val, bool):
-            return True
-        if isinstance(input_val, str):
-            return input_val.lower() in ("true", "false")
-        return False
-
     try:
         deviceid = ObjectIdentifier(deviceid)
         objectid = ObjectIdentifier(objectid)
@@ -667,6 +1022,16 @@ async def write_property(
 
     LOGGER.error(f"{deviceid}, {objectid}, {property}, {value}, {priority}")
 
-    await events.write_queue.put(
-        [deviceid, objectid, property, value, array_index, priority]
+    request = WriteRequest(
+        device_identifier=deviceid,
+        object_identifier=objectid,
+        property_identifier=property,
+        value=value,
+        array_index=array_index,
+        priority=priority,
     )
+
+    await events.write_queue.put(request)
+
+    if wait:
+        return (await wait_for_writes([request], timeout))[0]
@@ -0,0 +1,580 @@
+"""Write engine for BACnet add-on."""
+
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any
+
+from bacpypes3.apdu import (ErrorRejectAbortNack, RejectPDU,
+                            WritePropertyMultipleRequest)
+from bacpypes3.basetypes import (ErrorType, Null, PropertyValue,
+                                 ServicesSupported, WriteAccessSpecification)
+from bacpypes3.constructeddata import Any as AnyValue
+from bacpypes3.constructeddata import Array
+from bacpypes3.primitivedata import ObjectIdentifier, PropertyIdentifier
+from const import LOGGER
+
+# abort and reject reasons of a WritePropertyMultiple that is too large for the device
+too_large_reasons = (
+    "bufferOverflow",
+    "segmentationNotSupported",
+    "apduTooLong",
+)
+
+
+def describe_error(err) -> dict:
+    """Error message plus BACnet error class and code, or reject and abort reason."""
+    details = {"error": str(err)}
+
+    for attribute, key in (
+        ("errorClass", "error_class"),
+        ("errorCode", "error_code"),
+        ("apduReason", "reason"),
+        ("apduAbortRejectReason", "reason"),
+    ):
+        value = getattr(err, attribute, None)
+        if value is not None:
+            details[key] = getattr(value, "attr", str(value))
+
+    return details
+
+
+@dataclass
+class WriteRequest:
+    """A property write waiting to be sent, with a future that receives the result."""
+
+    device_identifier: ObjectIdentifier
+    object_identifier: ObjectIdentifier
+    property_identifier: PropertyIdentifier
+    value: Any = None
+    array_index: int | None = None
+    priority: int | None = None
+    queued: float = field(default_factory=time.monotonic)
+    acknowledged: float | None = None
+    future: asyncio.Future = field(
+        default_factory=lambda: asyncio.get_event_loop().create_future()
+    )
+
+    @classmethod
+    def from_queue_entry(cls, entry) -> "WriteRequest":
+        """Accept the [device, object, property, value, array index, priority] lists the API puts in the write queue."""
+        if isinstance(entry, WriteRequest):
+            return entry
+
+        device_identifier, object_identifier, property_identifier, value = entry[:4]
+        array_index = entry[4] if len(entry) > 4 else None
+        priority = entry[5] if len(entry) > 5 else None
+
+        return cls(
+            device_identifier=ObjectIdentifier(device_identifier),
+            object_identifier=ObjectIdentifier(object_identifier),
+            property_identifier=PropertyIdentifier(property_identifier),
+            value=value,
+            array_index=array_index,
+            priority=priority,
+        )
+
+    def complete(self, status: str, **details) -> None:
+        """Finish the request with a status like "acknowledged", "error" or "superseded"."""
+        if self.future.done():
+            return
+
+        self.future.set_result(
+            {
+                "status": status,
+                "latency": round(time.monotonic() - self.queued, 3),
+                **details,
+            }
+        )
+
+
+class WriteEngine:
+    """Dispatches writes concurrently across devices.
+
+    Each device gets a pending queue that's worked off by at most writes_per_device workers.
+    A pending write to the same property and priority as a newer write gets superseded, so only the newest value is sent.
+    Devices supporting WritePropertyMultiple get their pending writes sent in batches that fit their APDU size.
+    Acknowledged writes get verified by batched reads in the background.
+    """
+
+    def __init__(
+        self,
+        app,
+        write_queue: asyncio.Queue,
+        default_priority: int = 15,
+        writes_per_device: int = 2,
+        verify_delay: float = 0.1,
+    ) -> None:
+        self.app = app
+        self.write_queue = write_queue
+        self.default_priority = default_priority
+        self.writes_per_device = writes_per_device
+        self.verify_delay = verify_delay
+        self.pending: dict[int, deque] = {}
+        self.pending_writes: dict[tuple, WriteRequest] = {}
+        # keys with a write on its way, a newer write to the same key waits for it
+        self.in_flight: set[tuple] = set()
+        self.active_workers: dict[int, int] = {}
+        self.no_write_multiple: set[int] = set()
+        self.to_verify: dict[int, list[WriteRequest]] = {}
+        self.verifying_devices: set[int] = set()
+        self.verify_event = asyncio.Event()
+        self.tasks: set[asyncio.Task] = set()
+        self.ack_latencies: deque = deque(maxlen=1000)
+        self.total_latencies: deque = deque(maxlen=1000)
+        self.results: dict[str, int] = {}
+
+    async def run(self) -> None:
+        """Take writes off the write queue and hand them to the device workers."""
+        verifier = asyncio.create_task(self.verify_task())
+        try:
+            while True:
+                entry = await self.write_queue.get()
+
+                try:
+                    request = WriteRequest.from_queue_entry(entry)
+                except Exception as err:
+                    LOGGER.error(f"Invalid write request {entry}: {err}")
+                    continue
+
+                self.dispatch(request)
+
+        except asyncio.CancelledError as err:
+            LOGGER.warning(f"Write engine cancelled: {err}")
+            verifier.cancel()
+            for task in list(self.tasks):
+                task.cancel()
+
+    def dispatch(self, request: WriteRequest) -> None:
+        """Queue a write for its device and start a worker if there's room."""
+        device_id = request.device_identifier[1]
+
+        if not request.priority:
+            request.priority = self.default_priority
+
+        key = (
+            device_id,
+            request.object_identifier,
+            request.property_identifier,
+            request.array_index,
+            request.priority,
+        )
+
+        superseded = self.pending_writes.get(key)
+
+        self.pending_writes[key] = request
+
+        if superseded:
+            # keep the place in the queue, only the newest value gets sent
+            LOGGER.debug(
+                f"Write to {request.object_identifier} {request.property_identifier} superseded by {request.value}"
+            )
+            self.finish(superseded, "superseded")
+            return
+
+        self.pending.setdefault(device_id, deque()).append(key)
+
+        if self.active_workers.get(device_id, 0) < self.writes_per_device:
+            self.active_workers[device_id] = self.active_workers.get(device_id, 0) + 1
+            self.create_task(self.device_worker(device_id))
+
+    def create_task(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def device_worker(self, device_id: int) -> None:
+        """Send the pending writes of a device one after another."""
+        try:
+            pending = self.pending[device_id]
+            while pending:
+                limit = (
+                    self.batch_size(device_id)
+                    if len(pending) > 1 and self.supports_write_multiple(device_id)
+                    else 1
+                )
+
+                keys = self.take(device_id, limit)
+
+                if not keys:
+                    # the rest waits for writes in flight, their worker sends it next
+                    break
+
+                requests = [self.pending_writes.pop(key) for key in keys]
+
+                try:
+                    if len(requests) > 1:
+                        await self.write_multiple(requests)
+                    else:
+                        await self.write(requests[0])
+                finally:
+                    self.in_flight.difference_update(keys)
+        finally:
+            self.active_workers[device_id] -= 1
+            if not self.active_workers[device_id]:
+                self.active_workers.pop(device_id)
+                if not self.pending.get(device_id):
+                    self.pending.pop(device_id, None)
+
+    def take(self, device_id: int, limit: int) -> list[tuple]:
+        """Take up to limit pending writes of a device, skipping keys that have a write in flight."""
+        pending = self.pending[device_id]
+        keys: list[tuple] = []
+
+        for key in list(pending):
+            if len(keys) >= limit:
+                break
+            if key in self.in_flight:
+                continue
+            pending.remove(key)
+            self.in_flight.add(key)
+            keys.append(key)
+
+        return keys
+
+    async def write(self, request: WriteRequest) -> None:
+        """Send a single write and queue it for verification."""
+        priority = request.priority
+
+        value = Null("null") if request.value is None else request.value
+
+        address = self.app.dev_to_addr(request.device_identifier)
+
+        if address is None:
+            LOGGER.error(f"Can't write to unknown device {request.device_identifier}")
+            self.finish(request, "error", error="unknown device")
+            return
+
+        LOGGER.debug(
+            f"Writing: {request.device_identifier}, {request.object_identifier}, {request.property_identifier}, {value}, {priority}"
+        )
+
+        try:
+            response = await self.app.write_property(
+                address=address,
+                objid=request.object_identifier,
+                prop=request.property_identifier,
+                value=value,
+                array_index=request.array_index,
+                priority=priority,
+            )
+        except ErrorRejectAbortNack as err:
+            LOGGER.error(f"response: {err}")
+            self.finish(request, "error", **describe_error(err))
+            return
+        except Exception as err:
+            LOGGER.error(f"response: {err}")
+            self.finish(request, "error", **describe_error(err))
+            return
+
+        LOGGER.info(f"response: {response if response else 'Acknowledged'}")
+
+        self.acknowledge(request)
+
+    def acknowledge(self, request: WriteRequest) -> None:
+        """Note the acknowledge latency and queue the write for verification."""
+        request.acknowledged = time.monotonic()
+        self.ack_latencies.append(request.acknowledged - request.queued)
+
+        self.to_verify.setdefault(request.device_identifier[1], []).append(request)
+        self.verify_event.set()
+
+    def device_properties(self, device_id: int) -> dict:
+        device_key = f"device:{device_id}"
+        return self.app.bacnet_device_dict.get(device_key, {}).get(device_key, {})
+
+    def supports_write_multiple(self, device_id: int) -> bool:
+        if device_id in self.no_write_multiple:
+            return False
+
+        services_supported = self.device_properties(device_id).get(
+            "protocolServicesSupported", ServicesSupported()
+        )
+
+        return services_supported["write-property-multiple"] == 1
+
+    def batch_size(self, device_id: int) -> int:
+        """Estimate how many property values fit in one unsegmented WritePropertyMultiple."""
+        max_apdu = int(
+            self.device_properties(device_id).get("maxApduLengthAccepted", 480)
+        )
+        # roughly 8 bytes of header, up to 24 bytes per object, property, value and priority
+        return max(1, (max_apdu - 8) // 24)
+
+    def encode_value(self, request: WriteRequest) -> AnyValue:
+        """Cast the value to the datatype of the property, like write_property does."""
+        if request.value is None or isinstance(request.value, Null):
+            return AnyValue(Null("null"))
+
+        object_class = self.app.vendor_info.get_object_class(
+            request.object_identifier[0]
+        )
+        if object_class is None:
+            raise ValueError(f"unknown object type {request.object_identifier[0]}")
+
+        property_type = object_class.get_property_type(request.property_identifier)
+        if property_type is None:
+            raise ValueError(f"unknown property {request.property_identifier}")
+
+        if request.array_index is not None and issubclass(property_type, Array):
+            property_type = property_type._subtype
+
+        if not isinstance(request.value, property_type):
+            return AnyValue(property_type(request.value))
+
+        return AnyValue(request.value)
+
+    async def write_multiple(self, requests: list[WriteRequest]) -> None:
+        """Send several writes to one device in a single WritePropertyMultiple, falling back to single writes."""
+        device_identifier = requests[0].device_identifier
+        address = self.app.dev_to_addr(device_identifier)
+
+        if address is None:
+            for request in requests:
+                self.finish(request, "error", error="unknown device")
+            return
+
+        specifications: dict = {}
+        batched: list[WriteRequest] = []
+        single: list[WriteRequest] = []
+
+        for request in requests:
+            try:
+                property_value = PropertyValue(
+                    propertyIdentifier=request.property_identifier,
+                    propertyArrayIndex=request.array_index,
+                    value=self.encode_value(request),
+                    priority=request.priority,
+                )
+            except Exception as err:
+                # let write_property report what's wrong with this one
+                LOGGER.debug(f"Can't batch write {request.object_identifier}: {err}")
+                single.append(request)
+                continue
+
+            specifications.setdefault(request.object_identifier, []).append(
+                property_value
+            )
+            batched.append(request)
+
+        if batched:
+            wpm_request = WritePropertyMultipleRequest(
+                listOfWriteAccessSpecs=[
+                    WriteAccessSpecification(
+                        objectIdentifier=object_identifier,
+                        listOfProperties=property_values,
+                    )
+                    for object_identifier, property_values in specifications.items()
+                ],
+                destination=address,
+            )
+
+            LOGGER.debug(f"Writing {len(batched)} properties to {device_identifier}")
+
+            try:
+                response = await self.app.request(wpm_request)
+            except ErrorRejectAbortNack as err:
+                reason = getattr(err, "apduAbortRejectReason", None)
+                reason = getattr(reason, "attr", reason)
+
+                if isinstance(err, RejectPDU) and reason == "unrecognizedService":
+                    LOGGER.warning(
+                        f"{device_identifier} doesn't accept WritePropertyMultiple, writing one by one: {err}"
+                    )
+                    self.no_write_multiple.add(device_identifier[1])
+                    single.extend(batched)
+                elif reason in too_large_reasons and len(batched) > 1:
+                    LOGGER.debug(
+                        f"WritePropertyMultiple to {device_identifier} too large, splitting it: {err}"
+                    )
+                    half = len(batched) // 2
+                    await self.write_multiple(batched[:half])
+                    await self.write_multiple(batched[half:])
+                else:
+                    # busy or timed out, only this batch goes one by one
+                    LOGGER.warning(
+                        f"WritePropertyMultiple to {device_identifier} failed, writing one by one: {err}"
+                    )
+                    single.extend(batched)
+            else:
+                LOGGER.info(f"response: {response if response else 'Acknowledged'}")
+                for request in batched:
+                    self.acknowledge(request)
+
+        for request in single:
+            await self.write(request)
+
+    def finish(self, request: WriteRequest, status: str, **details) -> None:
+        """Complete a request and keep track of the results."""
+        self.results[status] = self.results.get(status, 0) + 1
+        if status == "acknowledged":
+            self.total_latencies.append(time.monotonic() - request.queued)
+        request.complete(status, **details)
+
+    async def verify_task(self) -> None:
+        """Start a verifier for each device with acknowledged writes to read back."""
+        try:
+            while True:
+                await self.verify_event.wait()
+
+                # give devices a moment to process, and let more writes join the batch
+                await asyncio.sleep(self.verify_delay)
+
+                self.verify_event.clear()
+
+                for device_id in list(self.to_verify):
+                    if device_id in self.verifying_devices:
+                        # its verifier takes the new writes after the current batch
+                        continue
+                    self.verifying_devices.add(device_id)
+                    self.create_task(self.device_verifier(device_id))
+
+        except asyncio.CancelledError as err:
+            LOGGER.debug(f"Write verification task cancelled: {err}")
+
+    async def device_verifier(self, device_id: int) -> None:
+        """Read back the acknowledged writes of a device in batches, so a slow device only delays its own writes."""
+        try:
+            while self.to_verify.get(device_id):
+                requests = self.to_verify.pop(device_id)
+
+                try:
+                    await self.verify_device(requests)
+                except (ErrorRejectAbortNack, Exception) as err:
+                    # a failing device must not keep its writes, or the next ones, waiting
+                    LOGGER.error(f"Write verification failed: {err}")
+                    for request in requests:
+                        if not request.future.done():
+                            self.finish(
+                                request,
+                                "acknowledged",
+                                verify_error=describe_error(err),
+                            )
+        finally:
+            self.verifying_devices.discard(device_id)
+
+    async def verify_device(self, requests: list[WriteRequest]) -> None:
+        """Read back the written properties of one device."""
+        device_identifier = requests[0].device_identifier
+        device_key = f"device:{device_identifier[1]}"
+        address = self.app.dev_to_addr(device_identifier)
+
+        services_supported = (
+            self.app.bacnet_device_dict.get(device_key, {})
+            .get(device_key, {})
+            .get("protocolServicesSupported", ServicesSupported())
+        )
+
+        values: dict = {}
+
+        if services_supported["read-property-multiple"] == 1 and len(requests) > 1:
+            values = await self.read_back_multiple(address, requests)
+
+        for request in requests:
+            key = (
+                request.object_identifier,
+                request.property_identifier,
+                request.array_index,
+            )
+
+            if key in values:
+                continue
+
+            try:
+                values[key] = await self.app.read_property(
+                    address=address,
+                    objid=request.object_identifier,
+                    prop=request.property_identifier,
+                    array_index=request.array_index,
+                )
+            except (ErrorRejectAbortNack, Exception) as err:
+                LOGGER.warning(
+                    f"Failed to verify write {device_identifier}, {request.object_identifier}, {request.property_identifier}: {err}"
+                )
+                values[key] = err
+
+        for request in requests:
+            value = values[
+                (
+                    request.object_identifier,
+                    request.property_identifier,
+                    request.array_index,
+                )
+            ]
+
+            if isinstance(value, (ErrorRejectAbortNack, Exception)):
+                self.finish(request, "acknowledged", verify_error=describe_error(value))
+                continue
+
+            LOGGER.info(f"Write result: {value}")
+
+            self.app.dict_updater(
+                device_identifier=device_identifier,
+                object_identifier=request.object_identifier,
+                property_identifier=request.property_identifier,
+                property_value=value,
+                source="write",
+            )
+
+            self.finish(request, "acknowledged", value=value)
+
+    async def read_back_multiple(self, address, requests: list[WriteRequest]) -> dict:
+        """Read back several written properties in one ReadPropertyMultiple."""
+        references: dict = {}
+
+        for request in requests:
+            reference = (
+                f"{request.property_identifier.attr}[{request.array_index}]"
+                if request.array_index is not None
+                else request.property_identifier.attr
+            )
+            references.setdefault(request.object_identifier, [])
+            if reference not in references[request.object_identifier]:
+                references[request.object_identifier].append(reference)
+
+        parameter_list: list = []
+
+        for object_identifier, property_references in references.items():
+            parameter_list.extend([object_identifier, property_references])
+
+        try:
+            response = await self.app.read_property_multiple(
+                address=address, parameter_list=parameter_list
+            )
+        except ErrorRejectAbortNack as err:
+            LOGGER.debug(f"Batched write verification failed, reading one by one: {err}")
+            return {}
+
+        return {
+            (object_identifier, property_identifier, property_array_index): value
+            for (
+                object_identifier,
+                property_identifier,
+                property_array_index,
+                value,
+            ) in response
+            if not isinstance(value, (ErrorRejectAbortNack, ErrorType))
+        }
+
+    def stats(self) -> dict:
+        """Write counts and latencies in seconds."""
+
+        def summary(latencies: deque) -> dict:
+            if not latencies:
+                return {"average": None, "max": None}
+            return {
+                "average": round(sum(latencies) / len(latencies), 3),
+                "max": round(max(latencies), 3),
+            }
+
+        return {
+            "pending": sum(len(pending) for pending in self.pending.values()),
+            "verifying": sum(
+                len(requests) for requests in self.to_verify.values()
+            ),
+            "results": self.results,
+            "acknowledge_latency": summary(self.ack_latencies),
+            "end_to_end_latency": summary(self.total_latencies),
+        }
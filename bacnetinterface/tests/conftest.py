@@ -0,0 +1,8 @@
+"""Make the add-on modules importable in tests."""
+
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "rootfs", "usr", "bin")
+)
@@ -0,0 +1,218 @@
+"""Subscription manager responses, notifications and filters."""
+
+import asyncio
+import json
+
+from bacpypes3.apdu import (AbortPDU, ConfirmedCOVNotificationRequest,
+                            error_types)
+from bacpypes3.basetypes import PropertyIdentifier
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier
+from bacpypes3.vendor import get_vendor_info
+from subscriptionManager import SubscriptionManager
+
+device_identifier = ObjectIdentifier("device:100")
+object_identifier = ObjectIdentifier("analogInput:1")
+
+
+class FakeApp:
+    """Just enough of the application for the subscription manager."""
+
+    def __init__(self, response: BaseException) -> None:
+        self.response = response
+        self.bacnet_device_dict = {}
+        self.cov_health = {}
+        self.polled = []
+        self.updates = []
+        self.cov_filters = []
+        self.seen = []
+        self.vendor_info = get_vendor_info(0)
+
+    def dev_to_addr(self, device_identifier):
+        return Address("192.168.1.10")
+
+    async def request(self, apdu):
+        raise self.response
+
+    def get_config_from_addon_config(self, device_identifier) -> dict:
+        return {}
+
+    def dict_updater(self, **kwargs) -> None:
+        self.updates.append(kwargs["property_identifier"])
+
+    def device_seen(self, device_id: int) -> None:
+        self.seen.append(device_id)
+
+    def start_fallback_poll(self, device_identifier, object_identifier) -> None:
+        self.polled.append(object_identifier)
+
+    def stop_fallback_poll(self, device_identifier, object_identifier) -> None:
+        self.polled.remove(object_identifier)
+
+
+def subscribe(response: BaseException, tmp_path):
+    app = FakeApp(response)
+    manager = SubscriptionManager(
+        app=app,
+        subscription_list=[],
+        state_path=str(tmp_path / "cov_subscriptions.json"),
+    )
+    subscription = manager.subscribe(device_identifier, object_identifier, lifetime=300)
+    return app, manager, subscription
+
+
+def test_error_response_learns_capacity(tmp_path):
+    async def run():
+        app, manager, subscription = subscribe(
+            error_types[5](errorClass="resources", errorCode="noSpaceToAddListElement"),
+            tmp_path,
+        )
+
+        assert not await manager.send(subscription)
+
+        assert subscription.status == "standby"
+        assert subscription.settled.is_set()
+        assert manager.capacity == {100: 0}
+        assert app.polled == [object_identifier]
+
+    asyncio.run(run())
+
+
+def test_abort_response_falls_back_to_polling(tmp_path):
+    async def run():
+        app, manager, subscription = subscribe(AbortPDU(reason="noResponse"), tmp_path)
+
+        assert not await manager.send(subscription)
+
+        assert subscription.status == "failed"
+        assert subscription.settled.is_set()
+        assert app.polled == [object_identifier]
+        assert subscription.renew_at is not None
+
+    asyncio.run(run())
+
+
+def test_cancel_error_is_caught(tmp_path):
+    async def run():
+        _, manager, subscription = subscribe(AbortPDU(reason="noResponse"), tmp_path)
+
+        assert not await manager.send_cancel(subscription, [subscription])
+
+    asyncio.run(run())
+
+
+def test_deadband_drops_unchanged_notifications(tmp_path):
+    async def run():
+        app, manager, subscription = subscribe(AbortPDU(reason="noResponse"), tmp_path)
+        subscription.deadband = 1.0
+
+        present_value = PropertyIdentifier("presentValue")
+        status_flags = PropertyIdentifier("statusFlags")
+
+        manager.filter(subscription, {present_value: 20.0, status_flags: [0, 0, 0, 0]})
+        assert app.updates == [present_value, status_flags]
+
+        manager.filter(subscription, {present_value: 20.1, status_flags: [0, 0, 0, 0]})
+        assert app.updates == [present_value, status_flags]
+        assert subscription.filtered == 1
+
+        manager.filter(subscription, {present_value: 21.5, status_flags: [0, 0, 0, 0]})
+        assert app.updates[2:] == [present_value]
+
+    asyncio.run(run())
+
+
+def notification(process_identifier: int) -> ConfirmedCOVNotificationRequest:
+    return ConfirmedCOVNotificationRequest(
+        subscriberProcessIdentifier=process_identifier,
+        initiatingDeviceIdentifier=device_identifier,
+        monitoredObjectIdentifier=object_identifier,
+        timeRemaining=300,
+        listOfValues=[],
+    )
+
+
+def test_notification_counts_as_sign_of_life(tmp_path):
+    async def run():
+        app, manager, subscription = subscribe(AbortPDU(reason="noResponse"), tmp_path)
+
+        assert await manager.handle_notification(
+            notification(subscription.process_identifier)
+        )
+        assert app.seen == [100]
+
+    asyncio.run(run())
+
+
+def test_unknown_process_identifier_is_refused_right_away(tmp_path):
+    async def run():
+        _, manager, subscription = subscribe(AbortPDU(reason="noResponse"), tmp_path)
+
+        # no waiting, unknown subscriptions get refused within a loop iteration
+        assert not await asyncio.wait_for(
+            manager.handle_notification(
+                notification(subscription.process_identifier + 1)
+            ),
+            0.05,
+        )
+
+    asyncio.run(run())
+
+
+def orphan_manager(tmp_path, **kwargs) -> tuple[FakeApp, SubscriptionManager]:
+    state_path = tmp_path / "cov_subscriptions.json"
+    state_path.write_text(
+        json.dumps(
+            [
+                {
+                    "device": "device:100",
+                    "objects": ["analogInput:1"],
+                    "process_identifier": 42,
+                    "confirmed": True,
+                    "group": False,
+                    "expires": None,
+                }
+            ]
+        )
+    )
+
+    app = FakeApp(AbortPDU(reason="noResponse"))
+    manager = SubscriptionManager(
+        app=app, subscription_list=[], state_path=str(state_path), **kwargs
+    )
+    manager.load_state()
+    return app, manager
+
+
+def test_orphan_is_adopted_and_its_notifications_wait(tmp_path):
+    async def run():
+        app, manager = orphan_manager(tmp_path)
+
+        assert 42 in manager.orphans
+
+        # a notification of the previous run arrives before the object is subscribed to again
+        waiting = asyncio.create_task(manager.handle_notification(notification(42)))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+
+        subscription = manager.subscribe(
+            device_identifier, object_identifier, lifetime=300
+        )
+
+        assert subscription.process_identifier == 42
+        assert not manager.orphans
+        assert await asyncio.wait_for(waiting, 1)
+        assert app.seen == [100]
+
+    asyncio.run(run())
+
+
+def test_orphan_not_taken_over_gets_refused(tmp_path):
+    async def run():
+        _, manager = orphan_manager(tmp_path, context_wait=0.01)
+
+        assert not await manager.handle_notification(notification(42))
+        # the wait for it is over, later notifications get refused right away
+        assert not manager.pending_contexts
+
+    asyncio.run(run())
@@ -0,0 +1,233 @@
+"""Write engine dispatch and verification."""
+
+import asyncio
+
+from bacpypes3.apdu import AbortPDU, RejectPDU, error_types
+from bacpypes3.basetypes import ServicesSupported
+from bacpypes3.pdu import Address
+from bacpypes3.primitivedata import ObjectIdentifier, PropertyIdentifier
+from bacpypes3.vendor import get_vendor_info
+from writeEngine import WriteEngine, WriteRequest
+
+
+class FakeApp:
+    def __init__(self) -> None:
+        self.bacnet_device_dict = {}
+        self.updates = []
+
+    def dev_to_addr(self, device_identifier):
+        return Address("192.168.1.10")
+
+    async def read_property(self, address, objid, prop, array_index=None):
+        if objid[1] == 1:
+            raise error_types[12](errorClass="property", errorCode="unknownProperty")
+        return 21.5
+
+    def dict_updater(self, **kwargs) -> None:
+        self.updates.append(kwargs)
+
+
+def write_request(instance: int, device: int = 100) -> WriteRequest:
+    return WriteRequest(
+        device_identifier=ObjectIdentifier(f"device:{device}"),
+        object_identifier=ObjectIdentifier(f"analogValue:{instance}"),
+        property_identifier=PropertyIdentifier("presentValue"),
+        value=21.5,
+    )
+
+
+def test_failed_read_back_completes_writes():
+    async def run():
+        engine = WriteEngine(
+            app=FakeApp(), write_queue=asyncio.Queue(), verify_delay=0
+        )
+        verifier = asyncio.create_task(engine.verify_task())
+
+        failing = write_request(1)
+        engine.acknowledge(failing)
+        result = await asyncio.wait_for(failing.future, 1)
+
+        assert result["status"] == "acknowledged"
+        assert result["verify_error"]["error_code"] == "unknownProperty"
+
+        # the verifier keeps going for the next writes
+        later = write_request(2, device=200)
+        engine.acknowledge(later)
+        result = await asyncio.wait_for(later.future, 1)
+
+        assert result["value"] == 21.5
+        assert engine.stats()["verifying"] == 0
+
+        verifier.cancel()
+
+    asyncio.run(run())
+
+
+class SlowWriteApp(FakeApp):
+    def __init__(self) -> None:
+        super().__init__()
+        self.writing: set = set()
+        self.overlapped = False
+        self.written = []
+
+    async def write_property(self, address, objid, prop, value, array_index, priority):
+        key = (objid, prop, priority)
+        if key in self.writing:
+            self.overlapped = True
+        self.writing.add(key)
+        await asyncio.sleep(0.01)
+        self.writing.discard(key)
+        self.written.append(value)
+
+
+def test_writes_to_the_same_property_never_overlap():
+    async def run():
+        app = SlowWriteApp()
+        engine = WriteEngine(app=app, write_queue=asyncio.Queue(), verify_delay=0)
+
+        first = write_request(1)
+        engine.dispatch(first)
+        await asyncio.sleep(0)
+
+        # the first write is in flight, the second worker must not send this one alongside it
+        second = write_request(1)
+        second.value = 22.0
+        engine.dispatch(second)
+
+        await asyncio.wait_for(asyncio.gather(*engine.tasks), 1)
+
+        assert not app.overlapped
+        assert app.written == [21.5, 22.0]
+        assert not engine.in_flight
+        assert not engine.pending
+
+    asyncio.run(run())
+
+
+class StalledDeviceApp(FakeApp):
+    def __init__(self) -> None:
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def read_property(self, address, objid, prop, array_index=None):
+        if objid[1] == 1:
+            # device 100 doesn't answer until released
+            await self.release.wait()
+        return 21.5
+
+
+def test_slow_device_does_not_hold_back_verification():
+    async def run():
+        app = StalledDeviceApp()
+        engine = WriteEngine(app=app, write_queue=asyncio.Queue(), verify_delay=0)
+        verifier = asyncio.create_task(engine.verify_task())
+
+        stalled = write_request(1)
+        engine.acknowledge(stalled)
+        await asyncio.sleep(0.01)
+
+        other = write_request(2, device=200)
+        engine.acknowledge(other)
+        result = await asyncio.wait_for(other.future, 1)
+
+        assert result["value"] == 21.5
+        assert not stalled.future.done()
+
+        app.release.set()
+        result = await asyncio.wait_for(stalled.future, 1)
+
+        assert result["value"] == 21.5
+
+        verifier.cancel()
+
+    asyncio.run(run())
+
+
+class WritePropertyMultipleApp(SlowWriteApp):
+    def __init__(self, response=None) -> None:
+        super().__init__()
+        services_supported = ServicesSupported([])
+        services_supported["write-property-multiple"] = 1
+        self.bacnet_device_dict = {
+            "device:100": {
+                "device:100": {"protocolServicesSupported": services_supported}
+            }
+        }
+        self.vendor_info = get_vendor_info(0)
+        self.response = response
+        self.batches = []
+
+    async def request(self, apdu):
+        self.batches.append(len(apdu.listOfWriteAccessSpecs))
+        error = self.response and self.response(len(apdu.listOfWriteAccessSpecs))
+        if error:
+            raise error
+
+
+def write_batch(app) -> list[WriteRequest]:
+    async def run():
+        engine = WriteEngine(app=app, write_queue=asyncio.Queue(), verify_delay=0)
+        requests = [write_request(instance) for instance in range(4)]
+        await engine.write_multiple(requests)
+        return engine, requests
+
+    return asyncio.run(run())
+
+
+def test_unrecognized_service_disables_write_multiple():
+    app = WritePropertyMultipleApp(
+        lambda size: RejectPDU(reason="unrecognizedService")
+    )
+    engine, requests = write_batch(app)
+
+    assert 100 in engine.no_write_multiple
+    assert app.written == [21.5] * 4
+
+
+def test_timeout_only_writes_this_batch_one_by_one():
+    app = WritePropertyMultipleApp(lambda size: AbortPDU(reason="noResponse"))
+    engine, requests = write_batch(app)
+
+    assert engine.supports_write_multiple(100)
+    assert app.written == [21.5] * 4
+
+
+def test_oversized_write_multiple_gets_split():
+    app = WritePropertyMultipleApp(
+        lambda size: AbortPDU(reason="segmentationNotSupported") if size > 2 else None
+    )
+    engine, requests = write_batch(app)
+
+    assert engine.supports_write_multiple(100)
+    assert app.batches == [4, 2, 2]
+    assert not app.written
+    assert len(engine.to_verify[100]) == 4
+
+
+def test_pending_writes_to_the_same_property_are_coalesced():
+    async def run():
+        app = SlowWriteApp()
+        engine = WriteEngine(app=app, write_queue=asyncio.Queue(), verify_delay=0)
+
+        first = write_request(1)
+        engine.dispatch(first)
+        await asyncio.sleep(0)
+
+        # queued behind the write in flight, only the newest of these gets sent
+        replaced = write_request(1)
+        replaced.value = 22.0
+        engine.dispatch(replaced)
+
+        newest = write_request(1)
+        newest.value = 23.0
+        engine.dispatch(newest)
+
+        result = await asyncio.wait_for(replaced.future, 1)
+        assert result["status"] == "superseded"
+
+        await asyncio.wait_for(asyncio.gather(*engine.tasks), 1)
+
+        assert app.written == [21.5, 23.0]
+        assert engine.stats()["results"] == {"superseded": 1}
+
+    asyncio.run(run())